@@ -0,0 +1,302 @@
+"""
+Adaptive Huffman coding.
+
+The encoder and the decoder both start from a tree that only holds
+the "not yet transmitted" (NYT) leaf, and update the tree the same
+way after each letter, so they stay in step without a model being
+sent. A letter seen for the first time is written as the code of the
+NYT leaf followed by the letter itself, as a literal of the same
+width as after an escape in `huffman`. This is the FGK algorithm
+(Faller, Gallager and Knuth): the tree keeps the sibling property,
+that the nodes can be numbered in order of decreasing weight with
+siblings next to each other, by swapping a node with the first node
+of the same weight before it is incremented.
+"""
+
+from __future__ import annotations
+from typing import Iterable, IO, Optional, Union
+
+from huffman import (
+    BYTE_BITS, CODE_POINT_BITS, BitWriter, letters, read_chunks
+)
+
+
+class AdaptiveTree:
+    """
+    The adaptive Huffman tree, shared by the encoder and the decoder.
+
+    Nodes are numbers indexing the lists below. `order` lists the
+    nodes by decreasing weight, with the root first and the NYT leaf
+    last, and `rank` is the position of each node in it.
+
+    >>> t = AdaptiveTree()
+    >>> t.code('a')  # Just the literal, the NYT code is empty
+    (97, 21)
+    >>> t.update('a')
+    >>> t.code('a'), t.code('b')
+    ((1, 1), (98, 22))
+    """
+
+    binary: bool  # Whether the letters are byte values
+
+    def __init__(self, binary: bool = False):
+        """Start with a tree that only has the NYT leaf."""
+        self.binary = binary
+        self.literal_bits = BYTE_BITS if binary else CODE_POINT_BITS
+        self.weight = [0]
+        self.parent = [-1]
+        self.left = [-1]   # Leaves have no children
+        self.right = [-1]
+        self.letter: list[Optional[letters]] = [None]
+        self.order = [0]
+        self.rank = [0]
+        self.root = self.nyt = 0
+        self.leaves: dict[letters, int] = {}
+
+    def _path(self, node: int) -> tuple[int, int]:
+        """The code of node, as the bits and the number of bits."""
+        code = length = 0
+        parent = self.parent
+        while node != self.root:
+            up = parent[node]
+            code |= (self.right[up] == node) << length
+            length += 1
+            node = up
+        return code, length
+
+    def code(self, letter: letters) -> tuple[int, int]:
+        """The code to write for letter before updating the tree."""
+        leaf = self.leaves.get(letter)
+        if leaf is not None:
+            return self._path(leaf)
+        code, length = self._path(self.nyt)
+        point = letter if self.binary else ord(letter)
+        if point >> self.literal_bits:
+            raise ValueError(f"{letter!r} does not fit in a literal")
+        return code << self.literal_bits | point, length + self.literal_bits
+
+    def _new_node(self, parent: int, letter: Optional[letters]) -> int:
+        """Add a leaf of weight zero last in the order."""
+        node = len(self.weight)
+        self.weight.append(0)
+        self.parent.append(parent)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.letter.append(letter)
+        self.rank.append(len(self.order))
+        self.order.append(node)
+        return node
+
+    def _leader(self, node: int) -> int:
+        """The first node in the order with the same weight as node."""
+        # The weights before node are sorted, so we can bisect.
+        w, weight, order = self.weight[node], self.weight, self.order
+        lo, hi = 0, self.rank[node]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if weight[order[mid]] > w:
+                lo = mid + 1
+            else:
+                hi = mid
+        return order[lo]
+
+    def _swap(self, a: int, b: int) -> None:
+        """Swap the subtrees at a and b, and their places in the order."""
+        parent, left, right = self.parent, self.left, self.right
+        pa, pb = parent[a], parent[b]
+        if pa == pb:
+            left[pa], right[pa] = right[pa], left[pa]
+        else:
+            if left[pa] == a:
+                left[pa] = b
+            else:
+                right[pa] = b
+            if left[pb] == b:
+                left[pb] = a
+            else:
+                right[pb] = a
+            parent[a], parent[b] = pb, pa
+        ra, rb = self.rank[a], self.rank[b]
+        self.order[ra], self.order[rb] = b, a
+        self.rank[a], self.rank[b] = rb, ra
+
+    def update(self, letter: letters) -> None:
+        """Count one more occurrence of letter."""
+        node = self.leaves.get(letter)
+        if node is None:
+            # The NYT leaf gets two children: the new letter and the
+            # new NYT leaf.
+            old = self.nyt
+            node = self._new_node(old, letter)
+            self.nyt = self._new_node(old, None)
+            self.left[old], self.right[old] = self.nyt, node
+            self.letter[old] = None
+            self.leaves[letter] = node
+        weight, parent = self.weight, self.parent
+        while node != self.root:
+            leader = self._leader(node)
+            if leader != node and leader != parent[node]:
+                self._swap(node, leader)
+            weight[node] += 1
+            node = parent[node]
+        weight[node] += 1
+
+
+class AdaptiveEncoder:
+    """
+    Encode letters in one pass, updating the code after each letter.
+
+    >>> e = AdaptiveEncoder()
+    >>> e.encode('abra') + e.encode('cadabra')
+    b'\\x00\\x03\\x08\\x00\\x0c@\\x00\\x1c\\x90\\x00\\x0cl\\x00\\x03#'
+    >>> e.close()
+    (b'`', 125)
+    """
+
+    def __init__(self, binary: bool = False):
+        """Set up an encoder for text, or for bytes with `binary`."""
+        self.tree = AdaptiveTree(binary)
+        self._writer = BitWriter()
+
+    def encode(self, x: Iterable[letters]) -> bytes:
+        """Encode x and return the bytes that are complete so far."""
+        tree, writer = self.tree, self._writer
+        for letter in x:
+            writer.write(*tree.code(letter))
+            tree.update(letter)
+        return writer.take()
+
+    def close(self) -> tuple[bytes, int]:
+        """Return the last, padded byte and the total number of bits."""
+        return self._writer.close(), self._writer.nbits
+
+
+class AdaptiveDecoder:
+    """
+    Decode the output of `AdaptiveEncoder` as it arrives.
+
+    Only the last byte of the input can hold padding, so we hold it
+    back until `finish` tells us how many bits there are.
+
+    >>> d = AdaptiveDecoder()
+    >>> data, nbits = adaptive_encode('abracadabra')
+    >>> d.feed(data[:5]) + d.feed(data[5:]) + d.finish(nbits)
+    'abracadabra'
+    """
+
+    def __init__(self, binary: bool = False):
+        """Set up a decoder for text, or for bytes with `binary`."""
+        self.tree = AdaptiveTree(binary)
+        self._node = self.tree.root  # Where we are in the tree
+        self._literal = -1           # Bits read of a literal, or -1
+        self._point = 0
+        self._held = b''             # The last byte we got
+        self._nbits = 0              # Bits decoded so far
+
+    def _decode(self, data: bytes, nbits: int) -> list[letters]:
+        """Decode the first `nbits` bits of data."""
+        tree = self.tree
+        left, right = tree.left, tree.right
+        node, literal, point = self._node, self._literal, self._point
+        decoded: list[letters] = []
+        for i in range(nbits):
+            bit = data[i >> 3] >> (7 - (i & 7)) & 1
+            if literal < 0:
+                node = right[node] if bit else left[node]
+                if node == tree.nyt:
+                    literal, point = 0, 0
+                elif left[node] < 0:
+                    letter = tree.letter[node]
+                    decoded.append(letter)  # type: ignore[arg-type]
+                    tree.update(letter)  # type: ignore[arg-type]
+                    node = tree.root
+                continue
+            point = point << 1 | bit
+            literal += 1
+            if literal == tree.literal_bits:
+                letter = point if tree.binary else chr(point)
+                decoded.append(letter)
+                tree.update(letter)
+                node, literal = tree.root, -1
+        self._node, self._literal, self._point = node, literal, point
+        self._nbits += nbits
+        return decoded
+
+    def _start(self) -> None:
+        """Read the literal of the first letter if the tree is empty."""
+        if self._literal < 0 and self._node == self.tree.nyt:
+            self._literal, self._point = 0, 0
+
+    def _join(self, decoded: list[letters]) -> Union[str, bytes]:
+        """Turn decoded letters into a string or bytes."""
+        return bytes(decoded) if self.tree.binary \
+            else "".join(decoded)  # type: ignore[arg-type]
+
+    def feed(self, chunk: bytes) -> Union[str, bytes]:
+        """Decode the letters that are complete after adding chunk."""
+        if not chunk:
+            return self._join([])
+        data = self._held + bytes(chunk)
+        self._held = data[-1:]
+        self._start()
+        return self._join(self._decode(data, 8 * (len(data) - 1)))
+
+    def finish(self, nbits: int) -> Union[str, bytes]:
+        """Decode the last letters, given the total number of bits."""
+        rest = nbits - self._nbits
+        if not 0 <= rest <= 8 * len(self._held):
+            raise ValueError("the number of bits does not match the input")
+        self._start()
+        decoded = self._decode(self._held, rest)
+        self._held = b''
+        # An empty input stops before the literal of the first letter
+        if self._nbits and (self._literal >= 0
+                            or self._node != self.tree.root):
+            raise ValueError("the bits end in the middle of a code")
+        return self._join(decoded)
+
+
+def adaptive_encode(x: Union[str, bytes]) -> tuple[bytes, int]:
+    """Encode x with adaptive Huffman coding.
+
+    Returns the packed bytes and the number of bits, like
+    `Encoding.encode_packed`, but no model is needed to decode.
+
+    >>> adaptive_encode(b'aab')
+    (b'a\\x98\\x80', 18)
+    """
+    enc = AdaptiveEncoder(not isinstance(x, str))
+    data = enc.encode(x)
+    last, nbits = enc.close()
+    return data + last, nbits
+
+
+def adaptive_decode(data: bytes, nbits: int,
+                    binary: bool = False) -> Union[str, bytes]:
+    """Decode the first `nbits` bits of data from `adaptive_encode`.
+
+    >>> adaptive_decode(*adaptive_encode(b'aab'), binary=True)
+    b'aab'
+    """
+    dec = AdaptiveDecoder(binary)
+    return dec.feed(data) + dec.finish(nbits)  # type: ignore[operator]
+
+
+def encode_stream(x: Union[str, bytes, Iterable, IO], out: IO[bytes],
+                  binary: bool = False, chunk_size: int = 1 << 16) -> int:
+    """Encode x chunk by chunk in one pass, writing the bytes to out.
+
+    x can be anything `read_chunks` accepts. Returns the number of
+    bits written.
+
+    >>> import io
+    >>> out = io.BytesIO()
+    >>> encode_stream(['abra', 'cadabra'], out), out.getvalue()[-2:]
+    (125, b'#`')
+    """
+    enc = AdaptiveEncoder(binary)
+    for chunk in read_chunks(x, chunk_size):
+        out.write(enc.encode(chunk))
+    last, nbits = enc.close()
+    out.write(last)
+    return nbits
@@ -0,0 +1,210 @@
+"""
+Benchmarks for Huffman coding.
+
+Run it as `python3 src/benchmark.py` to time each stage of Huffman
+coding, building the tree with `encoding`, the code table with
+`build_encoding_table`, and encoding and decoding with each engine,
+across alphabet sizes, input sizes and skews of the letter
+frequencies, or on the synthetic corpora from `corpus`. For each
+stage we report the throughput in MB/s of the original text and the
+peak memory used, and with `--json` the results are saved so runs
+can be compared.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+from typing import Callable, Iterator, Optional, Union
+
+from corpus import KINDS, corpus
+from huffman import Encoding, build_encoding_table, encoding, np
+
+METHODS = ("heap", "two-queue")
+
+# The exponent of the Zipf-like letter frequencies for each skew
+SKEWS = {"uniform": 0.0, "zipf": 1.0, "steep": 2.0}
+
+
+def best_time(f: Callable[[], object], repeat: int = 5) -> float:
+    """Get the best time in seconds of `repeat` calls to f."""
+    return min(timeit.repeat(f, number=1, repeat=repeat))
+
+
+def peak_memory(f: Callable[[], object]) -> int:
+    """Get the peak number of bytes allocated during a call to f.
+
+    We trace the allocations in a separate call, since tracing slows
+    down the code we are timing.
+
+    >>> peak_memory(lambda: bytearray(10**6)) >= 10**6
+    True
+    """
+    tracemalloc.start()
+    try:
+        f()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def random_text(alphabet_size: int, n: int, seed: int = 0,
+                skew: float = 1.0) -> str:
+    """Make a string of length n with Zipf-like letter frequencies.
+
+    The i'th most frequent letter has weight 1 / i**skew, so a skew
+    of zero gives uniform frequencies.
+
+    >>> len(random_text(10, 100)), len(set(random_text(3, 100))) <= 3
+    (100, True)
+    >>> _ = random_text(100_000, 1000).encode('utf-8')
+    """
+    rng = random.Random(seed)
+    # Skip the surrogates, which can't be encoded as UTF-8
+    alphabet = [chr(0x100 + i + (0x800 if 0x100 + i >= 0xd800 else 0))
+                for i in range(alphabet_size)]
+    weights = [1 / (i + 1) ** skew for i in range(alphabet_size)]
+    return "".join(rng.choices(alphabet, weights, k=n))
+
+
+def stages(x: Union[str, bytes]) -> dict[str, Callable[[], object]]:
+    """The stages to time for the text x, by name.
+
+    The encoders and decoders share an encoding that is built up
+    front, so they only time the coding itself.
+    """
+    enc = Encoding(x)
+    data, nbits = enc.encode_packed(x)
+    enc.decode(data, nbits)  # Build the lazy decoding tables
+    funcs: dict[str, Callable[[], object]] = {
+        f"encoding[{method}]": (lambda m=method: encoding(x, method=m))
+        for method in METHODS}
+    funcs["build_encoding_table"] = lambda: build_encoding_table(enc.tree)
+    funcs["encode"] = lambda: enc.encode(x)
+    funcs["encode_packed"] = lambda: enc.encode_packed(x)
+    funcs["decode"] = lambda: enc.decode(data, nbits)
+    if np is not None:
+        funcs["encode_numpy"] = lambda: enc.encode_numpy(x)
+        funcs["decode_numpy"] = lambda: enc.decode_numpy(data, nbits)
+    return funcs
+
+
+def run_case(x: Union[str, bytes], repeat: int = 3,
+             only: Optional[list[str]] = None) -> list[dict]:
+    """Time each stage on x and measure its peak memory."""
+    size = len(x.encode('utf-8') if isinstance(x, str) else x)
+    results = []
+    for stage, f in stages(x).items():
+        if only and stage not in only:
+            continue
+        seconds = best_time(f, repeat)
+        results.append({
+            "stage": stage,
+            "seconds": seconds,
+            "mb_per_s": size / max(seconds, 1e-9) / 2**20,
+            "peak_bytes": peak_memory(f),
+        })
+    return results
+
+
+def inputs(alphabet_sizes: list[int], sizes: list[int], skews: list[str],
+           corpora: Optional[list[str]] = None
+           ) -> Iterator[tuple[str, Union[str, bytes]]]:
+    """The inputs to run the stages on, with their names.
+
+    With `corpora`, we use those kinds of corpus in each size, and
+    otherwise random text for each alphabet size, size and skew.
+    """
+    if corpora:
+        for kind in corpora:
+            for n in sizes:
+                yield kind, corpus(kind, n)
+        return
+    for alphabet_size in alphabet_sizes:
+        for n in sizes:
+            for skew in skews:
+                yield skew, random_text(alphabet_size, n, skew=SKEWS[skew])
+
+
+def run_suite(alphabet_sizes: list[int], sizes: list[int],
+              skews: list[str], repeat: int = 3,
+              only: Optional[list[str]] = None,
+              corpora: Optional[list[str]] = None) -> list[dict]:
+    """Run every stage on every input, see `inputs`."""
+    results = []
+    for name, x in inputs(alphabet_sizes, sizes, skews, corpora):
+        for result in run_case(x, repeat, only):
+            results.append({"input": name, "alphabet": len(set(x)),
+                            "n": len(x), **result})
+            print_result(results[-1])
+    return results
+
+
+def print_result(result: dict) -> None:
+    """Print one result as a line of the table."""
+    print(f"{result['alphabet']:>9} {result['n']:>10} {result['input']:>9} "
+          f"{result['stage']:<22} {result['seconds']:>10.4f}s "
+          f"{result['mb_per_s']:>9.2f} MB/s "
+          f"{result['peak_bytes'] / 2**20:>9.2f} MB", flush=True)
+
+
+def _int_list(text: str) -> list[int]:
+    """Parse a comma-separated list of sizes like '1000,10_000'."""
+    return [int(item) for item in text.split(',')]
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(
+        prog='python3 src/benchmark.py',
+        description="Time the stages of Huffman coding.")
+    parser.add_argument('-a', '--alphabets', type=_int_list,
+                        default=[16, 256, 10_000, 100_000],
+                        help="alphabet sizes "
+                             "(default: 16,256,10000,100000)")
+    parser.add_argument('-n', '--sizes', type=_int_list,
+                        default=[10_000, 1_000_000],
+                        help="letters of input (default: 10000,1000000)")
+    parser.add_argument('-s', '--skews', default=list(SKEWS),
+                        type=lambda text: text.split(','),
+                        help="skews of the letter frequencies "
+                             f"(default: {','.join(SKEWS)})")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="runs per stage, we keep the best "
+                             "(default: %(default)s)")
+    parser.add_argument('-c', '--corpora', type=lambda text: text.split(','),
+                        help="use these kinds of corpus instead of random "
+                             f"text ({','.join(KINDS)})")
+    parser.add_argument('--only', type=lambda text: text.split(','),
+                        help="only run these stages")
+    parser.add_argument('--json', metavar='FILE',
+                        help="save the results as JSON")
+    args = parser.parse_args(argv)
+    if unknown := set(args.skews) - set(SKEWS):
+        parser.error(f"unknown skews: {', '.join(sorted(unknown))}")
+    if unknown := set(args.corpora or ()) - set(KINDS):
+        parser.error(f"unknown corpora: {', '.join(sorted(unknown))}")
+
+    print(f"{'alphabet':>9} {'n':>10} {'input':>9} {'stage':<22} "
+          f"{'time':>11} {'throughput':>14} {'peak':>12}")
+    results = run_suite(args.alphabets, args.sizes, args.skews,
+                        args.repeat, args.only, args.corpora)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                "python": sys.version,
+                "platform": platform.platform(),
+                "numpy": None if np is None else np.__version__,
+                "time": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                "results": results,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
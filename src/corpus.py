@@ -0,0 +1,250 @@
+"""
+Synthetic corpora for testing and benchmarking.
+
+Each kind of corpus is made by a function that takes the number of
+letters and a random number generator. `generate` makes a corpus in
+chunks, seeding each chunk from the seed and the chunk number, so the
+same seed always gives the same corpus, and a corpus of any size can
+be written to a file without holding it in memory:
+
+    python3 src/corpus.py english 100M -o english.txt
+
+The kinds are English-like text with Zipf word frequencies, DNA with
+a biased base composition, log lines, uniform random bytes, a single
+letter repeated, and letters with Fibonacci frequencies, which give
+the deepest possible Huffman trees.
+"""
+
+from __future__ import annotations
+import argparse
+import random
+import sys
+from collections import Counter
+from functools import lru_cache
+from typing import Callable, Iterator, Optional, Union
+
+# Letter frequencies of English, in percent
+ENGLISH_LETTERS = {
+    'e': 12.7, 't': 9.1, 'a': 8.2, 'o': 7.5, 'i': 7.0, 'n': 6.7, 's': 6.3,
+    'h': 6.1, 'r': 6.0, 'd': 4.3, 'l': 4.0, 'c': 2.8, 'u': 2.8, 'm': 2.4,
+    'w': 2.4, 'f': 2.2, 'g': 2.0, 'y': 2.0, 'p': 1.9, 'b': 1.5, 'v': 1.0,
+    'k': 0.8, 'j': 0.2, 'x': 0.2, 'q': 0.1, 'z': 0.1,
+}
+
+# The base composition of the DNA, which is AT-rich
+DNA_BASES = {'A': 0.3, 'C': 0.2, 'G': 0.2, 'T': 0.3}
+
+
+@lru_cache(maxsize=None)
+def vocabulary(size: int = 5000) -> tuple[str, ...]:
+    """Made-up words with English letter frequencies, most common first.
+
+    Like in English, the common words tend to be short. The vocabulary
+    doesn't depend on the seed, so all English-like corpora share
+    their words and only differ in the text.
+
+    >>> len(vocabulary(100)), len(set(vocabulary(100)))
+    (100, 100)
+    """
+    rng = random.Random("vocabulary")
+    letters, weights = zip(*ENGLISH_LETTERS.items())
+    words: dict[str, float] = {}  # Words and their sort keys
+    while len(words) < size:
+        length = min(2 + int(rng.expovariate(0.35)), 15)
+        word = "".join(rng.choices(letters, weights, k=length))
+        words.setdefault(word, length + rng.uniform(0, 6))
+    return tuple(sorted(words, key=words.__getitem__))
+
+
+def english(n: int, rng: random.Random) -> str:
+    """English-like text: sentences of words with Zipf frequencies.
+
+    >>> english(40, random.Random(0))
+    'Eni wc ay ef ni blc wv be aeo th tk od l'
+    """
+    words = vocabulary()
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    parts: list[str] = []
+    length = 0
+    while length < n:
+        sentence = rng.choices(words, weights, k=rng.randint(3, 20))
+        sentence[0] = sentence[0].capitalize()
+        text = " ".join(sentence) + rng.choice(".....?!")
+        text += "\n" if rng.random() < 0.3 else " "
+        parts.append(text)
+        length += len(text)
+    return "".join(parts)[:n]
+
+
+def dna(n: int, rng: random.Random) -> str:
+    """DNA with the base composition in `DNA_BASES`.
+
+    >>> dna(20, random.Random(0))
+    'TTCAGCTCCGTGATGATTTT'
+    """
+    return "".join(rng.choices(list(DNA_BASES), list(DNA_BASES.values()),
+                               k=n))
+
+
+LEVELS = {'INFO': 80, 'DEBUG': 10, 'WARN': 7, 'ERROR': 3}
+COMPONENTS = ('api', 'auth', 'db', 'cache', 'scheduler', 'worker')
+MESSAGES = (
+    "request handled path=/api/v1/items/{id} status={status} "
+    "latency={ms}ms",
+    "user {id} logged in from 10.0.{a}.{b}",
+    "cache miss key=item:{id}",
+    "query took {ms}ms rows={rows}",
+    "job {id} finished in {ms}ms",
+    "retrying connection attempt={a}",
+)
+
+
+def log_lines(n: int, rng: random.Random) -> str:
+    """Log lines with timestamps, levels, components and messages.
+
+    >>> log_lines(200, random.Random(0)).splitlines()[0]
+    '2023-11-15T18:29:18.118Z WARN  [db-3] query took 67ms rows=497'
+    """
+    import datetime
+    levels, level_weights = list(LEVELS), list(LEVELS.values())
+    time = 1_700_000_000.0 + rng.uniform(0, 86400)
+    lines: list[str] = []
+    length = 0
+    while length < n:
+        time += rng.expovariate(20.0)
+        stamp = datetime.datetime.fromtimestamp(time, datetime.timezone.utc)
+        message = rng.choice(MESSAGES).format(
+            id=rng.randrange(100_000), status=rng.choice((200, 200, 404, 500)),
+            ms=int(rng.expovariate(0.05)), rows=rng.randrange(1000),
+            a=rng.randrange(256), b=rng.randrange(256))
+        line = (f"{stamp.strftime('%Y-%m-%dT%H:%M:%S')}."
+                f"{stamp.microsecond // 1000:03d}Z "
+                f"{rng.choices(levels, level_weights)[0]:<5} "
+                f"[{rng.choice(COMPONENTS)}-{rng.randrange(8)}] {message}\n")
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)[:n]
+
+
+def uniform_bytes(n: int, rng: random.Random) -> bytes:
+    """Random bytes, all 256 values equally likely.
+
+    >>> len(uniform_bytes(10, random.Random(0)))
+    10
+    """
+    return rng.randbytes(n)
+
+
+def single_letter(n: int, rng: random.Random) -> str:
+    """The same letter n times, the smallest alphabet there is.
+
+    >>> single_letter(5, random.Random(0))
+    'aaaaa'
+    """
+    return "a" * n
+
+
+def fibonacci(n: int, rng: random.Random) -> str:
+    """Letters whose counts are Fibonacci numbers, in random order.
+
+    These counts make the Huffman tree a path, so the longest code is
+    as long as it can be for the alphabet. We use as many letters as
+    fit in n, and make up the rest with the most frequent one.
+
+    >>> sorted(Counter(fibonacci(20, random.Random(0))).values())
+    [1, 1, 2, 3, 5, 8]
+    """
+    counts: list[int] = []
+    a, b = 1, 1
+    while sum(counts) + a <= n:
+        counts.append(a)
+        a, b = b, a + b
+    if counts:
+        counts[-1] += n - sum(counts)
+    x = [chr(ord('a') + i) if i < 26 else chr(0x100 + i)
+         for i, count in enumerate(counts) for _ in range(count)]
+    rng.shuffle(x)
+    return "".join(x)
+
+
+KINDS: dict[str, Callable[[int, random.Random], Union[str, bytes]]] = {
+    'english': english,
+    'dna': dna,
+    'logs': log_lines,
+    'bytes': uniform_bytes,
+    'single': single_letter,
+    'fibonacci': fibonacci,
+}
+
+
+def generate(kind: str, n: int, seed: int = 0,
+             chunk_size: int = 1 << 20) -> Iterator[Union[str, bytes]]:
+    """Generate a corpus of n letters of the given kind in chunks.
+
+    Each chunk is made with its own generator, seeded with the seed
+    and the chunk number, so the corpus only depends on the seed and
+    the chunk size.
+
+    >>> [len(chunk) for chunk in generate('dna', 25, chunk_size=10)]
+    [10, 10, 5]
+    """
+    if kind not in KINDS:
+        raise ValueError(f"unknown kind of corpus {kind!r}")
+    make = KINDS[kind]
+    for i, start in enumerate(range(0, n, chunk_size)):
+        yield make(min(chunk_size, n - start), random.Random(f"{seed}:{i}"))
+
+
+def corpus(kind: str, n: int, seed: int = 0,
+           chunk_size: int = 1 << 20) -> Union[str, bytes]:
+    """Make a whole corpus of n letters of the given kind.
+
+    >>> corpus('dna', 25) == corpus('dna', 25)
+    True
+    """
+    chunks = list(generate(kind, n, seed, chunk_size))
+    empty = b'' if kind == 'bytes' else ''
+    return empty.join(chunks)  # type: ignore[attr-defined]
+
+
+def parse_size(text: str) -> int:
+    """Parse a size like '512', '64K', '10M' or '2G'.
+
+    >>> parse_size('64K'), parse_size('2G')
+    (65536, 2147483648)
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    text = text.strip().upper().removesuffix('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Write a corpus to a file or stdout."""
+    parser = argparse.ArgumentParser(
+        prog='python3 src/corpus.py',
+        description="Generate a synthetic corpus.")
+    parser.add_argument('kind', choices=list(KINDS))
+    parser.add_argument('size', type=parse_size,
+                        help="number of letters, e.g. 64K, 10M or 2G")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help="seed of the generator (default: 0)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    out = sys.stdout.buffer if args.output == '-' \
+        else open(args.output, 'wb')
+    try:
+        for chunk in generate(args.kind, args.size, args.seed):
+            out.write(chunk if isinstance(chunk, bytes)
+                      else chunk.encode('utf-8'))
+    finally:
+        if args.output != '-':
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+FM-indexes over Huffman-shaped wavelet trees.
+
+The FM-index of a text finds the occurrences of a pattern without
+scanning the text. It holds the Burrows-Wheeler transform (BWT) of
+the text, the letter before each suffix with the suffixes in sorted
+order, in a Huffman-shaped wavelet tree from `wavelet`, so it takes
+about H0 bits per letter. Counting the occurrences of a pattern is a
+backward search with two rank queries per letter of the pattern. To
+locate them, we also keep the position of every `sample_rate`'th
+suffix, and walk back through the BWT from the other suffixes until
+we reach a sampled one.
+
+To search a collection of reads, join them with a separator that
+does not occur in them, like a newline, and map the positions back to
+the reads.
+"""
+
+from __future__ import annotations
+from array import array
+from typing import Union
+
+from huffman import Encoding, letters
+from wavelet import BitVector, WaveletTree
+
+
+def suffix_array(x: Union[str, bytes]) -> list[int]:
+    """The start positions of the suffixes of x, in sorted order.
+
+    We sort by prefix doubling: once the suffixes are ranked by their
+    first k letters, sorting them by the ranks at i and at i + k ranks
+    them by their first 2k letters. A suffix sorts before the longer
+    suffixes it is a prefix of.
+
+    >>> suffix_array('banana')
+    [5, 3, 1, 0, 4, 2]
+    """
+    n = len(x)
+    points = [ord(a) for a in x] if isinstance(x, str) else list(x)
+    # Ranks start at one, so zero can stand for past the end
+    alphabet = {p: r for r, p in enumerate(sorted(set(points)), 1)}
+    rank = [alphabet[p] for p in points]
+    sa = sorted(range(n), key=rank.__getitem__)
+    k = 1
+    while n and rank[sa[-1]] < n:  # Until the ranks are all different
+        key = [r * (n + 1) + s for r, s in zip(rank, rank[k:] + [0] * k)]
+        sa.sort(key=key.__getitem__)
+        r, last = 0, -1
+        for i in sa:
+            if key[i] != last:
+                r, last = r + 1, key[i]
+            rank[i] = r
+        k *= 2
+    return sa
+
+
+class FMIndex:
+    """
+    An FM-index of a string or bytes.
+
+    The BWT has a row for each suffix of the text followed by a
+    sentinel, which sorts first, and for the sentinel itself. The
+    sentinel can't be a letter of the wavelet tree, so we leave it out
+    and remember its row instead.
+
+    >>> fm = FMIndex('abracadabra', sample_rate=4)
+    >>> fm.count('abra'), fm.locate('abra'), fm.locate('a')
+    (2, [0, 7], [0, 3, 5, 7, 10])
+    >>> fm.count('cab'), fm.count('')
+    (0, 12)
+    """
+
+    bwt: WaveletTree | None      # The BWT without the sentinel
+    sentinel: int                # The row of the sentinel in the BWT
+    starts: dict[letters, int]   # The first row starting with each letter
+    sampled: BitVector           # Whether each row's position is sampled
+    positions: array             # The sampled positions, by row
+    sample_rate: int
+
+    def __init__(self, x: Union[str, bytes], sample_rate: int = 32):
+        """Build the index of x, with a wavelet tree from x's encoding."""
+        if sample_rate < 1:
+            raise ValueError("the sample rate must be positive")
+        self.sample_rate = sample_rate
+        self._length = n = len(x)
+        sa = [n] + suffix_array(x)  # The sentinel's suffix sorts first
+        self.sentinel = sa.index(0)
+        bwt = [x[i - 1] for i in sa if i]
+        self.bwt = None if not x else WaveletTree(
+            bytes(bwt) if isinstance(x, (bytes, bytearray))
+            else "".join(bwt), Encoding(x))  # type: ignore[arg-type]
+        self.starts = {}
+        for row, i in enumerate(sa[1:], 1):
+            self.starts.setdefault(x[i], row)
+        self.sampled = BitVector(bytes(48 + (i % sample_rate == 0)
+                                       for i in sa))
+        self.positions = array('I' if n < 1 << 32 else 'Q',
+                               (i for i in sa if i % sample_rate == 0))
+
+    def __len__(self) -> int:
+        """The number of letters in the text."""
+        return self._length
+
+    def _rank(self, a: letters, row: int) -> int:
+        """The number of a's in the BWT before row."""
+        assert self.bwt is not None
+        return self.bwt.rank(a, row - (row > self.sentinel))
+
+    def _lf(self, row: int) -> int:
+        """The row of the suffix that is one letter longer than row's."""
+        assert self.bwt is not None
+        a, rank = self.bwt.access_rank(row - (row > self.sentinel))
+        return self.starts[a] + rank
+
+    def rows(self, pattern: Union[str, bytes]) -> range:
+        """The rows of the suffixes that start with pattern."""
+        lo, hi = 0, self._length + 1
+        for a in reversed(pattern):  # type: ignore[call-overload]
+            if a not in self.starts:
+                return range(0)
+            start = self.starts[a]
+            lo, hi = start + self._rank(a, lo), start + self._rank(a, hi)
+            if lo >= hi:
+                return range(0)
+        return range(lo, hi)
+
+    def count(self, pattern: Union[str, bytes]) -> int:
+        """The number of occurrences of pattern in the text."""
+        return len(self.rows(pattern))
+
+    def position(self, row: int) -> int:
+        """The position in the text of the suffix in row."""
+        steps = 0
+        while not self.sampled[row]:
+            row = self._lf(row)
+            steps += 1
+        return self.positions[self.sampled.rank(1, row)] + steps
+
+    def locate(self, pattern: Union[str, bytes]) -> list[int]:
+        """The positions of the occurrences of pattern, in order."""
+        return sorted(self.position(row) for row in self.rows(pattern))
+
+    def nbits(self) -> int:
+        """The number of bits used by the BWT and the samples."""
+        wavelet = 0 if self.bwt is None else self.bwt.nbits()
+        samples = 8 * self.positions.itemsize * len(self.positions)
+        return wavelet + self.sampled.nbits() + samples
@@ -7,9 +7,28 @@ and decoding strings given an encoding.
 
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Union, Optional, Iterator
+from typing import (
+    TYPE_CHECKING, Union, Optional, Iterator, Iterable, IO, Mapping
+)
+from array import array
 from collections import Counter
+from functools import cached_property
 import heapq as hq
+import io
+import itertools
+import math
+import os
+import struct
+import sys
+import zlib
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only needed for the bulk engines
+    np = None
 
 # We will use strings of 0 and 1 to represent bits as actually
 # working with bits is a little more involved and beyond the
@@ -17,8 +36,53 @@ import heapq as hq
 # club some day.
 bits = str
 # We don't have separate letters and strings in Python, so we
-# just pretend that we do
+# just pretend that we do. When we encode bytes, the letters are
+# the byte values, which are ints.
 letters = str
+# The bytes-like types we encode with byte values as letters
+BYTES_TYPES = (bytes, bytearray, memoryview)
+# An encoding can have an escape letter that stands for the letters it
+# has not seen. It is written as its code followed by the letter as a
+# literal of 8 bits for a byte or 21 bits for a code point. The escape
+# is the empty string for text and 256 for bytes, so it can't clash
+# with a real letter, and it is numbered one past the last letter.
+BYTE_BITS = 8
+CODE_POINT_BITS = 21
+ESCAPE_TEXT = ''
+ESCAPE_BYTES = 256
+_ESCAPE_POINT = 0x110000
+
+
+def code_point(a: letters) -> int:
+    """The number of a letter, its code point or byte value.
+
+    >>> code_point('a'), code_point(97), code_point(ESCAPE_TEXT)
+    (97, 97, 1114112)
+    """
+    if isinstance(a, int):
+        return a
+    return ord(a) if a else _ESCAPE_POINT
+
+
+def point_letter(point: int, binary: bool) -> letters:
+    """The letter numbered `point`, the inverse of `code_point`.
+
+    >>> point_letter(97, False), point_letter(97, True)
+    ('a', 97)
+    """
+    if binary:
+        return point
+    return chr(point) if point != _ESCAPE_POINT else ESCAPE_TEXT
+
+
+def byte_view(x: Union[bytes, bytearray, memoryview]) -> memoryview:
+    """View bytes-like x as unsigned bytes, without copying it.
+
+    >>> byte_view(memoryview(array('H', [1]))).tolist()
+    [1, 0]
+    """
+    view = memoryview(x)
+    return view if view.format == 'B' and view.ndim == 1 else view.cast('B')
 
 # MixIn for comparing nodes
 
@@ -59,16 +123,199 @@ class Node(CountCmp):
 Tree = Union[Leaf, Node] 
 
 
+@dataclass
+class FlatTree:
+    """
+    A Huffman tree stored in parallel integer arrays.
+
+    Node i is an inner node with children left[i] and right[i], or a
+    leaf with left[i] == right[i] == -1 for the letter with code point
+    symbol[i], or for byte value symbol[i] if `binary` is set. Inner
+    nodes have symbol -1. Children come before their parents, so the
+    root is the last node. Compared to `Leaf` and
+    `Node` objects this takes a few machine words per node, and the
+    arrays pickle as plain bytes.
+
+    >>> flatten(encoding('aabacabaaa'))
+    FlatTree(left=array('q', [-1, -1, 0, -1, 2]),\
+ right=array('q', [-1, -1, 1, -1, 3]),\
+ symbol=array('q', [99, 98, -1, 97, -1]),\
+ count=array('q', [1, 2, 3, 7, 10]), binary=False)
+    """
+
+    left: array
+    right: array
+    symbol: array
+    count: array
+    binary: bool  # Whether the letters are byte values
+
+    def __init__(self, binary: bool = False) -> None:
+        """Create an empty tree."""
+        self.binary = binary
+        self.left = array('q')
+        self.right = array('q')
+        self.symbol = array('q')
+        self.count = array('q')
 
-def encoding(x: str) -> Tree: # build_huffmann_tree().
+    def add(self, symbol: int, count: int,
+            left: int = -1, right: int = -1) -> int:
+        """Add a node and return its index."""
+        self.left.append(left)
+        self.right.append(right)
+        self.symbol.append(symbol)
+        self.count.append(count)
+        return len(self.count) - 1
+
+    @property
+    def root(self) -> int:
+        """The index of the root."""
+        return len(self.count) - 1
+
+    def letter(self, i: int) -> letters:
+        """The letter in leaf i."""
+        return point_letter(self.symbol[i], self.binary)
+
+
+def flatten(tree: Tree) -> FlatTree:
+    """Copy a tree of `Leaf` and `Node` objects into a `FlatTree`."""
+    leaf = tree
+    while isinstance(leaf, Node):
+        leaf = leaf.left
+    flat = FlatTree(binary=isinstance(leaf.letter, int))
+    done: list[int] = []  # Indices of the finished subtrees
+    stack: list[tuple[Tree, bool]] = [(tree, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if isinstance(node, Leaf):
+            done.append(flat.add(code_point(node.letter), node.count))
+        elif children_done:
+            right = done.pop()
+            left = done.pop()
+            done.append(flat.add(-1, node.count, left, right))
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+    return flat
+
+
+def flat_heap_tree(counts: dict[letters, int]) -> FlatTree:
+    """Build a Huffman tree from counts directly as a `FlatTree`.
+
+    The heap holds (count, index) pairs, so we compare plain tuples
+    rather than calling `CountCmp.__lt__`.
+
+    >>> build_encoding_table(flat_heap_tree({'a': 7, 'b': 2, 'c': 1}))
+    {'c': '00', 'b': '01', 'a': '1'}
+    """
+    flat = FlatTree(binary=isinstance(next(iter(counts), ''), int))
+    heap = [(count, flat.add(code_point(a), count))
+            for a, count in counts.items()]
+    if not heap:
+        raise ValueError("cannot build a tree without letters")
+    hq.heapify(heap)
+    while len(heap) > 1:
+        left_count, left = hq.heappop(heap)
+        right_count, right = hq.heappop(heap)
+        count = left_count + right_count
+        hq.heappush(heap, (count, flat.add(-1, count, left, right)))
+    return flat
+
+
+def count_letters(x: Union[str, bytes, bytearray, memoryview],
+                  workers: Optional[int] = None,
+                  chunk_size: int = 1 << 22) -> dict[letters, int]:
+    """Count how often each letter occurs in x.
+
+    For bytes-like input the letters are the byte values, and we count
+    them in a 256-bin histogram. With numpy, large strings are counted
+    with `bincount` over their code points. Either way the letters come
+    out sorted, so the counts, and the trees built from them, don't
+    depend on which backend we used. With `workers`, chunks of x are
+    counted in that many processes and the counts added up.
+
+    >>> count_letters('abracadabra')
+    {'a': 5, 'b': 2, 'c': 1, 'd': 1, 'r': 2}
+    >>> count_letters(b'abba')
+    {97: 2, 98: 2}
+    """
+    if workers is not None and workers > 1 and len(x) > chunk_size:
+        from concurrent.futures import ProcessPoolExecutor
+        if isinstance(x, memoryview):
+            x = x.cast('B')
+        chunks = [x[i:i + chunk_size] for i in range(0, len(x), chunk_size)]
+        if not isinstance(x, str):
+            chunks = [bytes(chunk) for chunk in chunks]
+        total: Counter = Counter()
+        with ProcessPoolExecutor(workers) as pool:
+            for counts in pool.map(count_letters, chunks):
+                total.update(counts)
+        return dict(sorted(total.items()))
+    if isinstance(x, BYTES_TYPES):
+        if np is not None:
+            hist = np.bincount(np.frombuffer(x, dtype=np.uint8),
+                               minlength=256)
+            return {b: int(hist[b]) for b in np.flatnonzero(hist).tolist()}
+        return dict(sorted(Counter(memoryview(x).cast('B')).items()))
+    if np is None or len(x) < 1 << 16:
+        return dict(sorted(Counter(x).items()))
+    hist = np.zeros(0, dtype=np.int64)
+    for i in range(0, len(x), chunk_size):
+        # Lone surrogates are valid in str, e.g. from surrogateescape
+        chunk = x[i:i + chunk_size].encode('utf-32-le', 'surrogatepass')
+        cps = np.frombuffer(chunk, dtype='<u4')
+        chunk_hist = np.bincount(cps)
+        if len(chunk_hist) > len(hist):
+            chunk_hist[:len(hist)] += hist
+            hist = chunk_hist
+        else:
+            hist[:len(chunk_hist)] += chunk_hist
+    return {chr(cp): int(hist[cp]) for cp in np.flatnonzero(hist).tolist()}
+
+
+def encoding(x: Union[str, Mapping[letters, int]], # build_huffmann_tree().
+             max_code_length: Optional[int] = None,
+             method: str = "heap",
+             flat: bool = False) -> Union[Tree, FlatTree]:
     """Create Huffman tree for `x`.
     >>> x='aabacabaaa'
     >>> encoding(x)
     Node(count=10, left=Node(count=3, left=Leaf(letter='c', count=1),\
  right=Leaf(letter='b', count=2)), right=Leaf(letter='a', count=7))
+
+    With `max_code_length` we get the best tree where no letter is
+    deeper than that, shaped for canonical codes.
+    >>> code_lengths(encoding('abbccccdddddddd', max_code_length=2))
+    {'a': 2, 'b': 2, 'c': 2, 'd': 2}
+
+    The `method` picks how we build the tree: "heap" uses a heap of
+    trees, and "two-queue" sorts the counts once and merges in linear
+    time, see `two_queue_tree`.
+    >>> encoding(x, method="two-queue")
+    Node(count=10, left=Node(count=3, left=Leaf(letter='c', count=1),\
+ right=Leaf(letter='b', count=2)), right=Leaf(letter='a', count=7))
+
+    With `flat` we get the tree as a `FlatTree`.
+
+    Instead of a string, x can be the letter counts themselves.
+    >>> encoding({'a': 7, 'b': 2, 'c': 1}) == encoding(x)
+    True
     """
+    counts = x if isinstance(x, Mapping) else count_letters(x)
+    if flat:
+        if max_code_length is None and method == "heap":
+            return flat_heap_tree(counts)
+        return flatten(encoding(counts, max_code_length, method))
+    if max_code_length is not None:
+        lengths = limited_code_lengths(counts, max_code_length)
+        return tree_from_codes(canonical_codes(lengths), counts)
+    if method == "two-queue":
+        return two_queue_tree(counts)
+    if method != "heap":
+        raise ValueError(f"unknown method {method!r}")
+
     # Make a heap out of all the leaves, i.e. counts of the letters.
-    heap: list[Tree] = [Leaf(a, count) for a, count in Counter(x).items()]
+    heap: list[Tree] = [Leaf(a, count) for a, count in counts.items()]
     # heap = [Leaf(letter='a', count=3), Leaf(letter='b', count=1), 
     # Leaf(letter='c', count=1)]
     hq.heapify(heap) # the list representation of the heap is 
@@ -102,48 +349,251 @@ def encoding(x: str) -> Tree: # build_huffmann_tree().
     # value. The values of the binary heap created using heapq.heapify
     # are Huffman Trees. 
 
-def build_encoding_table(tree: Tree,
-                         bits: list[bits, ...] = [], # list of single
-                         # bits as strings in book.
+
+def two_queue_tree(counts: dict[letters, int]) -> Tree:
+    """Build a Huffman tree from counts with two queues.
+
+    Once the leaves are sorted by count, the merged nodes come out
+    in sorted order as well, so the two smallest trees are always at
+    the front of either the leaf queue or the node queue. That makes
+    the merging linear and lets us compare plain integers instead of
+    going through `CountCmp.__lt__`.
+
+    >>> two_queue_tree({'a': 7, 'b': 2, 'c': 1})
+    Node(count=10, left=Node(count=3, left=Leaf(letter='c', count=1),\
+ right=Leaf(letter='b', count=2)), right=Leaf(letter='a', count=7))
+    """
+    leaves = [Leaf(a, count) for count, a
+              in sorted((count, a) for a, count in counts.items())]
+    if not leaves:
+        raise ValueError("cannot build a tree without letters")
+    nodes: list[Tree] = []
+    i = j = 0  # Fronts of the leaf and node queues
+    n = len(leaves)
+    for _ in range(n - 1):
+        # Take the smaller front twice, preferring leaves on ties.
+        if j == len(nodes) or (i < n and leaves[i].count <= nodes[j].count):
+            left = leaves[i]
+            i += 1
+        else:
+            left = nodes[j]
+            j += 1
+        if j == len(nodes) or (i < n and leaves[i].count <= nodes[j].count):
+            right = leaves[i]
+            i += 1
+        else:
+            right = nodes[j]
+            j += 1
+        nodes.append(Node(left.count + right.count, left, right))
+    return nodes[-1] if nodes else leaves[0]
+
+
+def limited_code_lengths(counts: dict[letters, int],
+                         max_length: int) -> dict[letters, int]:
+    """Find optimal code lengths where no code is above `max_length`.
+
+    This is the package-merge algorithm. Think of each letter as a
+    coin worth 2^-1 for every bit in its code and with the letter's
+    count as its cost. We make `max_length` rounds of packaging the
+    cheapest coins in pairs and merging the packages back with the
+    letters, and the cheapest 2n - 2 items of the last round tell us
+    how many bits each letter should get.
+
+    >>> limited_code_lengths({'a': 1, 'b': 1, 'c': 2, 'd': 4, 'e': 8}, 3)
+    {'a': 3, 'b': 3, 'c': 3, 'd': 3, 'e': 1}
+    """
+    if max_length < 1:
+        raise ValueError("codes must be at least one bit long")
+    order = sorted(counts, key=lambda a: (counts[a], a))
+    if len(order) == 1:
+        return {order[0]: 1}
+    if len(order) > 1 << max_length:
+        raise ValueError(f"{len(order)} letters cannot be coded "
+                         f"in {max_length} bits")
+    # An item is (cost, i) for letter order[i] or (cost, (item, item))
+    # for a package.
+    Item = tuple[int, Union[int, tuple]]
+    coins: list[Item] = [(counts[a], i) for i, a in enumerate(order)]
+    items = coins
+    for _ in range(max_length - 1):
+        packages = [(items[i][0] + items[i + 1][0], (items[i], items[i + 1]))
+                    for i in range(0, len(items) - 1, 2)]
+        items = list(hq.merge(coins, packages, key=lambda item: item[0]))
+    depth = [0] * len(order)
+    stack = items[:2 * len(order) - 2]
+    while stack:
+        _, content = stack.pop()
+        if isinstance(content, int):
+            depth[content] += 1
+        else:
+            stack.extend(content)
+    return {a: depth[i] for i, a in enumerate(order)}
+
+
+def code_lengths(tree: Union[Tree, FlatTree]) -> dict[letters, int]:
+    """Get the length of the code for each letter in the tree.
+
+    >>> code_lengths(encoding('aabacabaaa'))
+    {'c': 2, 'b': 2, 'a': 1}
+    """
+    return {a: length for a, (_, length) in build_code_table(tree).items()}
+
+
+def canonical_codes(lengths: dict[letters, int]
+                    ) -> dict[letters, tuple[int, int]]:
+    """Assign canonical codes from the code lengths.
+
+    The letters are sorted by (length, letter), and each gets the
+    next code after the previous letter's, shifted left when the
+    length grows. The codes only depend on the lengths, so the
+    lengths are all we need to store to recover them.
+
+    >>> canonical_codes({'c': 2, 'b': 2, 'a': 1})
+    {'a': (0, 1), 'b': (2, 2), 'c': (3, 2)}
+    """
+    codes: dict[letters, tuple[int, int]] = {}
+    code, prev = 0, 0
+    for letter, length in sorted(lengths.items(),
+                                 key=lambda kv: (kv[1], kv[0])):
+        code <<= length - prev
+        codes[letter] = (code, length)
+        code += 1
+        prev = length
+    return codes
+
+
+def tree_from_codes(codes: dict[letters, tuple[int, int]],
+                    counts: Optional[dict[letters, int]] = None) -> Tree:
+    """Build the tree for a set of canonical codes.
+
+    In a canonical code the leaves at each depth sit to the left of
+    the inner nodes, so we can build the tree bottom up one level at
+    a time, pairing up the leaves and the nodes from the level below.
+    If `counts` is given, the leaves get their counts from it.
+
+    >>> tree_from_codes(canonical_codes({'c': 2, 'b': 2, 'a': 1}),
+    ...                 {'a': 7, 'b': 2, 'c': 1})
+    Node(count=10, left=Leaf(letter='a', count=7), right=Node(count=3,\
+ left=Leaf(letter='b', count=2), right=Leaf(letter='c', count=1)))
+    """
+    counts = counts if counts is not None else {}
+    if len(codes) == 1:
+        letter, = codes
+        return Leaf(letter, counts.get(letter, 0))
+    levels: dict[int, list[Tree]] = {}
+    for letter, (code, length) in sorted(codes.items(),
+                                         key=lambda kv: kv[1]):
+        levels.setdefault(length, []).append(
+            Leaf(letter, counts.get(letter, 0)))
+    below: list[Tree] = []
+    for depth in range(max(levels), 0, -1):
+        level = levels.get(depth, []) + below
+        if len(level) % 2:
+            raise ValueError("code lengths do not form a complete code")
+        below = [Node(left.count + right.count, left, right)
+                 for left, right in zip(level[::2], level[1::2])]
+    if len(below) != 1:
+        raise ValueError("code lengths do not form a complete code")
+    return below[0]
+
+
+def canonical_tree(tree: Union[Tree, FlatTree]) -> Tree:
+    """Reshape tree so its codes are the canonical codes.
+
+    The letters keep their depth, so the code is just as good, but
+    the codes now only depend on the lengths.
+
+    >>> build_encoding_table(canonical_tree(encoding('aabacabaaa')))
+    {'a': '0', 'b': '10', 'c': '11'}
+    """
+    if isinstance(tree, FlatTree):
+        counts = {tree.letter(i): tree.count[i]
+                  for i in range(len(tree.count)) if tree.left[i] < 0}
+        return tree_from_codes(canonical_codes(code_lengths(tree)), counts)
+    counts: dict[letters, int] = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Leaf):
+            counts[node.letter] = node.count
+        else:
+            stack.extend((node.left, node.right))
+    return tree_from_codes(canonical_codes(code_lengths(tree)), counts)
+
+
+def build_code_table(tree: Union[Tree, FlatTree]
+                     ) -> dict[letters, tuple[int, int]]:
+    """Get the code for each letter as a (code, length) pair.
+
+    The code is an integer whose `length` low bits are the bit pattern,
+    first bit highest. We walk the tree with an explicit stack and
+    carry the code along as an integer, so deep trees don't hit the
+    recursion limit, and there is no state shared between calls.
+
+    >>> build_code_table(encoding('aabacabaaa'))
+    {'c': (0, 2), 'b': (1, 2), 'a': (1, 1)}
+    """
+    codes: dict[letters, tuple[int, int]] = {}
+    if isinstance(tree, FlatTree):
+        left, right, symbol = tree.left, tree.right, tree.symbol
+        if left[tree.root] < 0:
+            return {tree.letter(tree.root): (0, 1)}  # A lone leaf
+        flat_stack = [(tree.root, 0, 0)]
+        while flat_stack:
+            i, code, length = flat_stack.pop()
+            if left[i] < 0:
+                codes[tree.letter(i)] = (code, length)
+            else:
+                code <<= 1
+                length += 1
+                flat_stack.append((right[i], code | 1, length))
+                flat_stack.append((left[i], code, length))
+        return codes
+    if isinstance(tree, Leaf):
+        return {tree.letter: (0, 1)}  # A lone leaf still gets one bit
+    stack: list[tuple[Tree, int, int]] = [(tree, 0, 0)]
+    while stack:
+        node, code, length = stack.pop()
+        if isinstance(node, Leaf):
+            codes[node.letter] = (code, length)
+        else:
+            code <<= 1
+            length += 1
+            stack.append((node.right, code | 1, length))
+            stack.append((node.left, code, length))
+    return codes
+
+
+def build_encoding_table(tree: Union[Tree, FlatTree],
+                         bits: Optional[list[bits]] = None, # list of
+                         # single bits as strings in book; a prefix
+                         # for all the codes.
                          table: Optional[dict[letters, bits]] = None, 
                          # called table in book. dictionary w. string-
                          # letters as keys and string-bits as values.
+                         canonical: bool = False,
                          ) -> dict[letters, bits]:
     """Traverse the tree to get the mapping for letters.
     >>> x = 'aabacabaaa'
     >>> tree = encoding(x)
     >>> build_encoding_table(tree)
     {'c': '00', 'b': '01', 'a': '1'}
+
+    With `canonical` we get the canonical codes for the same lengths.
+    >>> build_encoding_table(tree, canonical=True)
+    {'a': '0', 'b': '10', 'c': '11'}
     """
-    # The bits argument is intended as an accumulator of bits
-    # i.e. strings "0" or "1". If you are in a leaf, you can
-    # "".join(bits) to get the bit pattern. If not, you can
-    # recursively go down the tree to build the bit-patterns
-    # for each sub-tree. When you go left, add a 0 to bits and
-    # when you go right, add a 1. This isn't the most efficient
-    # solution, but it gets the job done, and we don't expect
-    # large trees in an application like this.
+    if canonical:
+        tree = canonical_tree(tree)
     table = table if table is not None else {} # 'table' in 'if table' 
     # evaluates to False if table = None and if table = {}.
-    if isinstance(tree, Leaf): # isinstance() returns True if the 
-        # object given as the first argument is of the type given by
-        # the second argument. 
-        # isinstance(tree, Leaf) returns True if the tree is an object
-        # of the type Leaf.
-        table[tree.letter] = ''.join(bits)
-        return table
-    else:
-        # go to the left
-        bits.append('0')
-        build_encoding_table(tree.left, bits, table)
-        # go to parent
-        bits.pop()
-        # go to the right
-        bits.append('1')
-        build_encoding_table(tree.right, bits, table)
-        # go to parent
-        bits.pop()
+    prefix = ''.join(bits) if bits else ''
+    if prefix and isinstance(tree, Leaf):
+        table[tree.letter] = prefix  # The prefix already leads here
         return table
+    for letter, (code, length) in build_code_table(tree).items():
+        table[letter] = prefix + format(code, f'0{length}b')
+    return table
 
 
 class BitIterator:
@@ -177,66 +627,1611 @@ class BitIterator:
             return
 
 
+class BitWriter:
+    """
+    Pack variable-length codes into bytes.
+
+    Codes are given as an integer together with its length in bits
+    and are written most significant bit first. Whole bytes are kept
+    in `out`, and the at most seven bits that do not fill a byte yet
+    wait in an accumulator until more bits arrive or we `close()`.
+
+    >>> w = BitWriter()
+    >>> w.write(0b1, 1)
+    >>> w.write(0b01, 2)
+    >>> w.close(), w.nbits
+    (b'\\xa0', 3)
+    """
+
+    out: bytearray  # The complete bytes written so far
+    nbits: int      # The total number of bits written
+
+    def __init__(self) -> None:
+        """Set up an empty writer."""
+        self.out = bytearray()
+        self.nbits = 0
+        self._acc = 0  # Pending bits, at most 7 between calls
+        self._n = 0    # Number of pending bits
+
+    def write(self, code: int, length: int) -> None:
+        """Write the `length` low bits of `code`."""
+        self._acc = (self._acc << length) | code
+        self._n += length
+        self.nbits += length
+        if self._n >= 8:
+            self._flush()
+
+    def write_all(self, x: Iterable[letters],
+                  codes: dict[letters, tuple[int, int]]) -> None:
+        """Write the code of each letter in `x`."""
+        # This is the hot loop of the encoder, so we keep the state
+        # in local variables and only flush when we have a few bytes.
+        out = self.out
+        acc, n, total = self._acc, self._n, self.nbits
+        for letter in x:
+            code, length = codes[letter]
+            acc = (acc << length) | code
+            n += length
+            total += length
+            if n >= 64:
+                k = n >> 3
+                n -= k << 3
+                out += (acc >> n).to_bytes(k, 'big')
+                acc &= (1 << n) - 1
+        self._acc, self._n, self.nbits = acc, n, total
+        self._flush()
+
+    def _flush(self) -> None:
+        """Move all complete bytes from the accumulator to `out`."""
+        k = self._n >> 3
+        if k:
+            self._n -= k << 3
+            self.out += (self._acc >> self._n).to_bytes(k, 'big')
+            self._acc &= (1 << self._n) - 1
+
+    def write_packed(self, data: bytes, nbits: int) -> None:
+        """Write the first `nbits` bits of the packed bytes data.
+
+        >>> w = BitWriter()
+        >>> w.write(0b1, 1)
+        >>> w.write_packed(b'\\xff\\x80', 9)
+        >>> w.close(), w.nbits
+        (b'\\xff\\xc0', 10)
+        """
+        whole, rest = nbits >> 3, nbits & 7
+        if self._n:
+            self.write(int.from_bytes(data[:whole], 'big'), 8 * whole)
+        else:
+            self.out += data[:whole]  # Already lined up with our bytes
+            self.nbits += 8 * whole
+        if rest:
+            self.write(data[whole] >> (8 - rest), rest)
+
+    def take(self) -> bytes:
+        """Remove and return the complete bytes written so far."""
+        data = bytes(self.out)
+        self.out.clear()
+        return data
+
+    def close(self) -> bytes:
+        """Pad the last byte with zeros and return the remaining bytes."""
+        if self._n:
+            self.out.append((self._acc << (8 - self._n)) & 0xff)
+            self._acc = self._n = 0
+        return self.take()
+
+
+def read_chunks(x: Union[str, bytes, Iterable, IO],
+                chunk_size: int = 1 << 16) -> Iterator[str]:
+    """Iterate over x in chunks.
+
+    x can be a string, an iterable of strings, or a file object, which
+    we read `chunk_size` characters at a time. Bytes work the same way.
+
+    >>> list(read_chunks(io.StringIO('abcde'), 2))
+    ['ab', 'cd', 'e']
+    >>> list(read_chunks(['ab', 'c']))
+    ['ab', 'c']
+    """
+    if isinstance(x, (str, *BYTES_TYPES)):
+        yield x
+    elif hasattr(x, 'read'):
+        while chunk := x.read(chunk_size):
+            yield chunk
+    else:
+        yield from x
+
+
+class _InvalidCode:
+    """Stand-in sub-table for bit patterns that are not a code."""
+
+    def lookup(self, acc: int, n: int) -> tuple[letters, int]:
+        """Refuse to decode."""
+        raise ValueError("bit pattern is not a code in this encoding")
+
+
+class DecodeTable:
+    """
+    Lookup table for decoding several bits at a time.
+
+    The table is indexed by the next `bits` bits of the input. For a
+    code of at most `bits` bits, every index that starts with the code
+    holds the letter and the code length in `entries`, so a single
+    lookup resolves the letter. Longer codes share their first `bits`
+    bits with other long codes, and the entry points to a sub-table
+    for the rest of the bits instead.
+
+    Short codes often leave room for more codes in the same window,
+    so `runs` holds all the letters that fit completely in each
+    window and how many bits they use. Most lookups in the decoder
+    go there and resolve several letters at once. When the letters are
+    byte values, the runs are bytes rather than strings. A run stops
+    at the `escape` letter, since a literal follows it.
+
+    >>> t = DecodeTable({'a': (1, 1), 'b': (1, 2), 'c': (0, 2)}, 2)
+    >>> t.entries
+    [('c', 2, None), ('b', 2, None), ('a', 1, None), ('a', 1, None)]
+    >>> t.runs
+    [('c', 2), ('b', 2), ('a', 1), ('aa', 2)]
+    """
+
+    bits: int        # Number of bits we look at in this table
+    max_length: int  # The longest code resolved through this table
+    entries: list[tuple[Optional[letters], int, Optional[DecodeTable]]]
+    runs: list[tuple[str | bytes, int]]  # Letters and bits, per window
+    binary: bool     # Whether the letters are byte values
+    escape: Optional[letters]  # The escape letter, if there is one
+
+    def __init__(self, codes: dict[letters, tuple[int, int]],
+                 max_bits: int = 12, runs: bool = True,
+                 escape: Optional[letters] = None):
+        """Build the table for `codes`, using at most `max_bits` bits."""
+        self.escape = escape
+        self.binary = isinstance(next(iter(codes), ''), int)
+        self.max_length = max((length for _, length in codes.values()),
+                              default=0)
+        self.bits = k = max_bits if runs else min(self.max_length, max_bits)
+        invalid = (None, 0, _InvalidCode())
+        self.entries = entries = [invalid] * (1 << k)
+        long_codes: dict[int, dict[letters, tuple[int, int]]] = {}
+        for letter, (code, length) in codes.items():
+            if length <= k:
+                start = code << (k - length)
+                for i in range(start, start + (1 << (k - length))):
+                    entries[i] = (letter, length, None)
+            else:
+                rest = length - k
+                prefix = long_codes.setdefault(code >> rest, {})
+                prefix[letter] = (code & ((1 << rest) - 1), rest)
+        for prefix, rest_codes in long_codes.items():
+            entries[prefix] = (None, k, DecodeTable(rest_codes, max_bits,
+                                                    runs=False))
+        self.runs = []
+        if runs:
+            mask = (1 << k) - 1
+            for window in range(1 << k):
+                run, used = [], 0
+                while used < k:
+                    letter, length, sub = entries[(window << used) & mask]
+                    if sub is not None or length > k - used \
+                            or letter == escape:
+                        break
+                    run.append(letter)
+                    used += length
+                self.runs.append((bytes(run) if self.binary
+                                  else "".join(run), used))
+
+    def lookup(self, acc: int, n: int) -> tuple[letters, int]:
+        """Find the letter at the front of the n low bits of acc.
+
+        We need n to be at least the longest code in the table. The
+        result is the letter and the length of its code.
+        """
+        letter, length, sub = self.entries[(acc >> (n - self.bits))
+                                           & ((1 << self.bits) - 1)]
+        if sub is None:
+            return letter, length
+        letter, rest = sub.lookup(acc, n - length)
+        return letter, length + rest
+
+
 # hvilken type object er x, siden det er nødvendigt med iter(x)?
 # enc er et object af typen Encoding. enc.tree giver et Huffmann tree
 # for en string. enc.table giver en dictionary med letters som keys og
 # bit-strings som values.
-def decode(x: bits, enc: Encoding) -> str:
+def decode(x: bits, enc: Encoding) -> str | bytes:
     """Decode the bit pattern x according to enc.
     >>> decode('1101100101111', Encoding('aabacabaaa'))
     'aabacabaaa'
     """
-    bits = iter(x)  # Makes it easier to run thought the bits
-    node = enc.tree  # We start in the root
-    decoding: list[str] = [] # list with letters. 
+    # Packing the string first lets us use the table decoder, which
+    # looks at several bits at a time instead of walking the tree.
+    nbits = len(x)
+    if x.count('0') + x.count('1') != nbits:
+        raise ValueError("bits must be a string of '0' and '1'")
+    packed = (int(x, 2) << (-nbits % 8)).to_bytes((nbits + 7) // 8, 'big') \
+        if nbits else b''
+    return decode_packed(packed, nbits, enc)
+
+
+def decode_packed(x: bytes, nbits: int, enc: Encoding) -> str | bytes:
+    """Decode the first `nbits` bits of the packed bytes x.
+
+    We get bytes back if the letters of the encoding are byte values.
+
+    >>> enc = Encoding('aabacabaaa')
+    >>> decode_packed(bytes([0b11011001, 0b01111000]), 13, enc)
+    'aabacabaaa'
+    """
+    if nbits > 8 * len(x):
+        raise ValueError(f"{nbits} bits requested from {len(x)} bytes")
+    decoder = IncrementalDecoder(enc, nbits)
+    return decoder.feed(x) + decoder.finish()
+
+
+# Stands in for the number of bits left when we don't know it yet
+_NO_LIMIT = 1 << 62
+
+# Passes over the lanes of `Encoding.decode_numpy` before we give up
+_RESYNC_PASSES = 8
+
+
+class IncrementalDecoder:
+    """
+    Decode packed bytes that arrive in pieces.
+
+    Each call to `feed` returns the letters that are complete in the
+    input seen so far, and keeps the bits of a code that continues in
+    the next chunk. The padding at the end of the input can look like
+    letters, so we need the total number of bits to know where to stop,
+    either when we create the decoder or when we call `finish`. Until
+    we know it, we hold back codes that end in the last seven bits.
+
+    >>> d = IncrementalDecoder(Encoding('aabacabaaa'), 13)
+    >>> d.feed(bytes([0b11011001])), d.feed(bytes([0b01111000]))
+    ('aabaca', 'baaa')
+    >>> d.finish()
+    ''
+    """
+
+    enc: Encoding
+
+    def __init__(self, enc: Encoding, nbits: Optional[int] = None):
+        """Set up a decoder for `nbits` bits, if we know how many."""
+        self.enc = enc
+        self._acc = 0   # The n low bits of acc are not decoded yet
+        self._n = 0
+        self._left = _NO_LIMIT if nbits is None else nbits
+
+    def feed(self, chunk: bytes) -> str | bytes:
+        """Decode the letters that are complete after adding chunk."""
+        table = self.enc.decode_table
+        k, mask, runs = table.bits, (1 << table.bits) - 1, table.runs
+        # An escape code is followed by a literal of literal_bits bits
+        escape, binary = table.escape, table.binary
+        literal_bits = 0 if escape is None else \
+            BYTE_BITS if binary else CODE_POINT_BITS
+        literal_mask = (1 << literal_bits) - 1
+        # Bits we need to resolve any code, and a literal after it
+        need = max(k, table.max_length + literal_bits)
+        step = max(need // 8 + 1, 6)     # Bytes to add when we run low
+        view = memoryview(chunk)
+        pos = 0
+        decoding: list[str] | bytearray = \
+            bytearray() if table.binary else []
+        append = decoding.append
+        extend = decoding.extend if table.binary else append
+        acc, n, left = self._acc, self._n, self._left
+        # Bits at the end that could be padding, if we don't know yet
+        slack = 7 if left >= _NO_LIMIT // 2 else 0
+        while left > 0:
+            if n < need + slack:
+                if pos < len(view):
+                    piece = view[pos:pos + step]
+                    pos += step
+                    acc = ((acc & ((1 << n) - 1)) << (8 * len(piece))) \
+                        | int.from_bytes(piece, 'big')
+                    n += 8 * len(piece)
+                    continue
+                # We are out of input, but the next code may still be
+                # complete. We pad with zeros for the lookup and keep
+                # the letter if its code only used real bits.
+                if n >= need:
+                    letter, length = table.lookup(acc, n)
+                else:
+                    letter, length = table.lookup(acc << (need - n), need)
+                extra = literal_bits if letter == escape else 0
+                if length + extra > n - slack:
+                    break  # The code continues in the next chunk
+                n -= length + extra
+                left -= length + extra
+                if extra:
+                    point = (acc >> n) & literal_mask
+                    letter = point if binary else chr(point)
+                append(letter)
+                continue
+            if left >= k:
+                # The whole window is real input, so take all the
+                # letters that fit in it.
+                run, length = runs[(acc >> (n - k)) & mask]
+                if length:
+                    n -= length
+                    left -= length
+                    extend(run)
+                    continue
+            letter, length = table.lookup(acc, n)
+            n -= length
+            left -= length
+            if letter == escape:
+                n -= literal_bits
+                left -= literal_bits
+                point = (acc >> n) & literal_mask
+                letter = point if binary else chr(point)
+            append(letter)
+        self._acc, self._n, self._left = acc, n, left
+        if left < 0:
+            raise ValueError("the bits end in the middle of a code")
+        return bytes(decoding) if table.binary else "".join(decoding)
+
+    def finish(self, nbits: Optional[int] = None) -> str | bytes:
+        """Decode the last letters, given the total number of bits.
+
+        The number of bits can be left out if we gave it when we
+        created the decoder. Raises ValueError if the input ended
+        before all the bits were there.
+        """
+        if nbits is not None:
+            if self._left < _NO_LIMIT // 2:
+                raise ValueError("the number of bits was already given")
+            self._left = nbits - (_NO_LIMIT - self._left)
+        elif self._left >= _NO_LIMIT // 2:
+            raise ValueError("need the number of bits to finish decoding")
+        rest = self.feed(b'')
+        if self._left > 0:
+            raise ValueError("the input ends in the middle of a code")
+        return rest
+
+
+class _EscapeCodes(dict):
+    """
+    Codes that fall back on the escape code for letters not in them.
+
+    The code for an unseen letter is the escape code followed by the
+    letter as a literal. With `as_bits` the codes are strings of bits,
+    like `Encoding.table`, rather than (code, length) pairs.
+
+    >>> codes = _EscapeCodes({'a': (0, 1), '': (1, 1)}, '')
+    >>> codes['a'], codes['b'] == (1 << 21 | ord('b'), 22)
+    ((0, 1), True)
+    """
+
+    def __init__(self, codes: dict, escape: letters, as_bits: bool = False):
+        """Wrap codes, which must have a code for escape."""
+        super().__init__(codes)
+        self.escape = escape
+        self.as_bits = as_bits
+        self.literal_bits = BYTE_BITS if isinstance(escape, int) \
+            else CODE_POINT_BITS
+
+    def __missing__(self, letter: letters) -> Union[tuple[int, int], bits]:
+        """The escape code and the literal for letter."""
+        point = code_point(letter)
+        if point >> self.literal_bits or letter == self.escape \
+                or isinstance(letter, int) != isinstance(self.escape, int):
+            raise KeyError(letter)
+        if self.as_bits:
+            return self[self.escape] + format(point, f'0{self.literal_bits}b')
+        code, length = self[self.escape]
+        return code << self.literal_bits | point, length + self.literal_bits
+
+
+# The encoding used by a worker process in `Encoding.encode_parallel`
+# and `Encoding.decode_parallel`, set once when the worker starts.
+_worker_encoding: Optional[Encoding] = None
+
+
+def _init_worker(enc: Encoding) -> None:
+    """Keep the encoding in the worker for the blocks to come."""
+    global _worker_encoding
+    _worker_encoding = enc
+
+
+def _encode_block(block: Union[str, bytes],
+                  enc: Optional[Encoding] = None) -> tuple[bytes, int]:
+    """Encode one block with enc, or with the worker's encoding."""
+    enc = _worker_encoding if enc is None else enc
+    assert enc is not None
+    w = BitWriter()
+    w.write_all(block, enc.codes)
+    return w.close(), w.nbits
+
+
+def _decode_block(task: tuple[bytes, int, int, int],
+                  enc: Optional[Encoding] = None) -> Union[str, bytes]:
+    """Decode one block with enc, or with the worker's encoding.
+
+    The task is the bytes the block is in, the number of bits to skip
+    at the start, the number of bits in the block, and its length.
+    """
+    enc = _worker_encoding if enc is None else enc
+    assert enc is not None
+    data, skip, nbits, length = task
+    if skip:
+        # Move the block to the start of the bytes
+        shifted = int.from_bytes(data, 'big') << skip
+        data = (shifted & ((1 << 8 * len(data)) - 1)).to_bytes(len(data),
+                                                                 'big')
+    decoded = decode_packed(data, nbits, enc)
+    if len(decoded) != length:
+        raise ValueError("block has the wrong number of letters")
+    return decoded
+
+
+@dataclass
+class BlockIndex:
+    """
+    Where the blocks of an encoding start, so they can be decoded apart.
+
+    Block i starts at bit `offsets[i]` and holds `lengths[i]` letters.
+
+    >>> index = BlockIndex([0, 5, 11], [4, 4, 2])
+    >>> index.bits(1, 13)
+    (5, 11)
+    """
+
+    offsets: list[int]  # The bit offset where each block starts
+    lengths: list[int]  # The number of letters in each block
+
+    def bits(self, i: int, nbits: int) -> tuple[int, int]:
+        """The bits of block i, in an encoding of nbits bits."""
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else nbits
+        return self.offsets[i], end
 
-    # When we have no more bits and ask for the next, we get
-    # a StopIteration. We will catch that and deal with it
-    # below
-    try:
-        while True:  # we break when there are no more bits
-            # Handle the current node.
-            # If it is a leaf, you want to add its letter to
-            # decoding, and after that you should go back to
-            # the root.
-            # If it is an inner node, you need to get the next
-            # bit, you can do that with `b = next(bits)`, and
-            # then you move the node to the left or right child
-            # based on the bit.
-
-            # b = next(bits) skal også bruges for at få den første bit.
-            b = next(bits)
-            if b == '0':
-                node = node.left
-            if b == '1': 
-                node = node.right
-            if isinstance(node, Leaf):
-                decoding.append(node.letter)
-                node = enc.tree
-    except StopIteration: # How come StopIteration exception, when this
-        # already handled in the next() method?
-        # When we asked for a bit that wasn't there, we end
-        # up here. We need to wrap up. We should only ever
-        # end here when we are in the root, so we assert that
-        assert enc.tree is node
-    # and if that is fine, we can return the decoding
-    return "".join(decoding)
 
 class Encoding:
     """Class used for Huffman encoding and decoding."""
 
-    tree: Tree  # The Huffman tree for the encoding.
+    tree: Union[Tree, FlatTree]  # The Huffman tree for the encoding.
     table: dict[letters, bits]  # Maps each letter to a bit-pattern 
+    codes: dict[letters, tuple[int, int]]  # Maps letters to (code, length)
+    lengths: dict[letters, int]  # Maps each letter to its code length
+    canonical: bool  # Whether the codes are the canonical codes
+    binary: bool  # Whether the letters are byte values
+    escape: Optional[letters]  # The escape letter, if there is one
+
+    def __init__(self, x: str | bytes, canonical: bool = False,
+                 max_code_length: Optional[int] = None,
+                 method: str = "heap", flat: bool = False,
+                 escape: bool = False):
+        """Create the encoding for `x`.
+
+        With `canonical`, the codes only depend on the code lengths,
+        so `lengths` is all it takes to recreate the encoding. With
+        `max_code_length`, no code is longer than that, and the codes
+        are always canonical. The `method` is passed on to `encoding`,
+        and with `flat` the tree is kept as a `FlatTree`.
+
+        If x is bytes-like, the letters are the byte values, and
+        decoding gives bytes back. To build the encoding from letter
+        counts instead, see `from_counts`.
 
-    def __init__(self, x: str):
-        """Create the encoding for `x`."""
-        self.tree = encoding(x) # build_huffmann_tree()
-        self.table = build_encoding_table(self.tree) 
+        With `escape`, the encoding gets an escape letter, counted
+        once, so it can also encode letters that are not in x.
+
+        >>> enc = Encoding('aabacabaaa', escape=True)
+        >>> enc.decode(enc.encode('abcd'))
+        'abcd'
+        """
+        if isinstance(x, memoryview):
+            x = byte_view(x)
+        self.binary = isinstance(x, BYTES_TYPES) or (
+            isinstance(x, Mapping) and isinstance(next(iter(x), ''), int))
+        if escape:
+            counts = dict(x) if isinstance(x, Mapping) else count_letters(x)
+            letter = ESCAPE_BYTES if self.binary else ESCAPE_TEXT
+            counts[letter] = counts.get(letter, 0) + 1
+            x = counts  # type: ignore[assignment]
+        self.tree = encoding(x, max_code_length, method, # build tree
+                             flat and not canonical)
+        if canonical and max_code_length is None:
+            self.tree = canonical_tree(self.tree)
+        if flat and not isinstance(self.tree, FlatTree):
+            self.tree = flatten(self.tree)
+        self.canonical = canonical or max_code_length is not None
+        self._build_tables()
+
+    @classmethod
+    def from_counts(cls, counts: Mapping[letters, int],
+                    **options) -> Encoding:
+        """Create the encoding for text with the given letter counts.
+
+        The options are those of `Encoding`. Letters with a count of
+        zero still get a code, so they can be encoded. We count them as
+        seen once, since a chain of letters with nothing to tell them
+        apart would otherwise make the tree as deep as it is wide.
+
+        >>> enc = Encoding.from_counts({'a': 7, 'b': 2, 'c': 1, 'd': 0})
+        >>> enc.decode(enc.encode('dab'))
+        'dab'
+        >>> enc.lengths['c'] == enc.lengths['d']
+        True
+        """
+        return cls({a: max(count, 1) for a, count  # type: ignore
+                    in sorted(counts.items())}, **options)
+
+    @classmethod
+    def from_corpus(cls, corpus: Iterable[Union[str, bytes]],
+                    **options) -> Encoding:
+        """Create an encoding from the letters of a training corpus.
+
+        The corpus is an iterable of strings, or of bytes, and the
+        encoding can then be used for any message over its letters,
+        so we only pay for counting and building the tree once.
+
+        >>> enc = Encoding.from_corpus(['abracadabra', 'abba'])
+        >>> enc.decode(enc.encode('cab'))
+        'cab'
+        """
+        counts: Counter = Counter()
+        for text in corpus:
+            counts.update(count_letters(text))
+        return cls.from_counts(counts, **options)
 
-    def encode(self, x: str) -> bits:
+    @classmethod
+    def from_lengths(cls, lengths: dict[letters, int]) -> Encoding:
+        """Create the canonical encoding with the given code lengths.
+
+        >>> enc = Encoding('aabacabaaa', canonical=True)
+        >>> Encoding.from_lengths(enc.lengths).table == enc.table
+        True
+        """
+        enc = cls.__new__(cls)
+        enc.tree = tree_from_codes(canonical_codes(lengths))
+        enc.canonical = True
+        enc.binary = isinstance(next(iter(lengths), ''), int)
+        enc._build_tables()
+        return enc
+
+    def _build_tables(self) -> None:
+        """Set up the tables for encoding and decoding from the tree."""
+        self.codes = build_code_table(self.tree)
+        self.table = {a: format(code, f'0{length}b')
+                      for a, (code, length) in self.codes.items()}
+        self.lengths = {a: length for a, (_, length) in self.codes.items()}
+        escape = ESCAPE_BYTES if self.binary else ESCAPE_TEXT
+        self.escape = escape if escape in self.codes else None
+        if self.escape is not None:
+            self.codes = _EscapeCodes(self.codes, escape)
+            self.table = _EscapeCodes(self.table, escape, as_bits=True)
+        for name in self._LAZY:
+            self.__dict__.pop(name, None)
+
+    # The tables we build when we first need them
+    _LAZY = ('decode_table', '_numpy_codes', '_numpy_decode_table')
+
+    def __getstate__(self) -> dict:
+        """Leave out the lazy tables when pickling, they are rebuilt."""
+        return {name: value for name, value in self.__dict__.items()
+                if name not in self._LAZY}
+
+    @cached_property
+    def decode_table(self) -> DecodeTable:
+        """The lookup table used when decoding, built on first use."""
+        return DecodeTable(self.codes, escape=self.escape)
+
+    def encode(self, x: str | bytes) -> bits:
         """Encode the string x according to the encoding."""
+        if isinstance(x, memoryview):
+            x = byte_view(x)
         return "".join(self.table[letter] for letter in x)
 
-    def decode(self, x: bits) -> str:
-        """Decode x according to this encoding."""
-        return decode(x, self)
\ No newline at end of file
+    def encode_packed(self, x: str | bytes) -> tuple[bytes, int]:
+        """Encode x into packed bytes.
+
+        Returns the bytes and the number of bits actually used; the
+        last byte is padded with zeros. A memoryview is read in
+        place, one byte per letter.
+
+        >>> Encoding('aabacabaaa').encode_packed('aabacabaaa')
+        (b'\\xd9x', 13)
+        >>> Encoding(b'aab').encode_packed(memoryview(b'aab'))
+        (b'\\xc0', 3)
+        """
+        if isinstance(x, memoryview):
+            x = byte_view(x)
+        w = BitWriter()
+        w.write_all(x, self.codes)
+        return w.close(), w.nbits
+
+    @cached_property
+    def _numpy_codes(self) -> tuple:
+        """The table of codes for `encode_numpy`, and if it has pairs.
+
+        Each entry holds a code aligned to the left of a 64-bit word,
+        with its length in the low six bits. Code points that are not
+        in the alphabet have length zero, and so does the escape
+        letter. If all the letters are below 256 and two codes fit in
+        an entry, the table has an entry for each pair of letters a, b
+        at a * 256 + b, followed by the single letters at 65536 + a,
+        so we only look up half as many entries.
+        """
+        if np is None:
+            raise ImportError("the NumPy engine needs numpy installed")
+        codes = {a: code for a, code in self.codes.items()
+                 if a != self.escape}
+        size = max(map(code_point, codes), default=0) + 1
+        values = np.zeros(max(size, 256), dtype=np.uint64)
+        lengths = np.zeros(max(size, 256), dtype=np.uint64)
+        for a, (code, length) in codes.items():
+            values[code_point(a)] = code
+            lengths[code_point(a)] = length
+        # Shifting by 64 gives zero, for the letters without codes
+        table = values << (np.uint64(64) - lengths) | lengths
+        if size > 256 or 2 * max(self.lengths.values()) > 57:
+            return table, False
+        codes = table & ~np.uint64(63)
+        pairs = (codes[:, None] | codes[None, :] >> lengths[:, None]
+                 | lengths[:, None] + lengths[None, :])
+        pairs[(lengths[:, None] == 0) | (lengths[None, :] == 0)] = 0
+        return np.concatenate([pairs.ravel(), table]), True
+
+    def _numpy_symbols(self, chunk: str | bytes, pairs: bool):
+        """The indices of the letters of chunk in `_numpy_codes`."""
+        if not pairs:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-32-le', 'surrogatepass')
+                return np.frombuffer(chunk, dtype='<u4')
+            return np.frombuffer(chunk, dtype=np.uint8)
+        if isinstance(chunk, str):
+            try:
+                chunk = chunk.encode('latin-1')
+            except UnicodeEncodeError:
+                # Some letters have no code; index them one by one
+                return 65536 + self._numpy_symbols(chunk, False)
+        symbols = np.frombuffer(chunk, dtype='>u2', count=len(chunk) // 2)
+        if len(chunk) & 1:
+            symbols = np.append(symbols.astype(np.uint32),
+                                np.uint32(65536 + chunk[-1]))
+        return symbols
+
+    def encode_numpy(self, x: str | bytes,
+                     chunk_size: int = 1 << 18) -> tuple[bytes, int]:
+        """Encode x into packed bytes with NumPy.
+
+        This gives the same result as `encode_packed`, but handles a
+        whole chunk of letters at a time. We look up all the codes, two
+        letters at a time for small alphabets, and find where each
+        starts with a cumulative sum. Then we split each code in two,
+        the bits in the 64-bit word it starts in and the bits that
+        spill into the next word, and since codes don't overlap, we
+        get the words by summing the parts with `add.reduceat`. On
+        English-like text this runs at about 85 MB/s, eight times as
+        fast as joining the codes of the letters and twenty times
+        `encode_packed`.
+        Codes longer than 57 bits go through `encode_packed`. Needs
+        numpy.
+
+        >>> enc = Encoding('aabacabaaa')
+        >>> enc.encode_numpy('aabacabaaa') == enc.encode_packed('aabacabaaa')
+        True
+        """
+        if isinstance(x, memoryview):
+            x = byte_view(x)
+        if max(self.lengths.values()) > 57:
+            return self.encode_packed(x)  # Codes don't fit in the arrays
+        table, pairs = self._numpy_codes
+        u64 = np.uint64
+        parts: list[bytes] = []
+        carry = u64(0)  # The last, incomplete word so far
+        nbits = 0
+        for start in range(0, len(x), chunk_size):
+            chunk = x[start:start + chunk_size]
+            symbols = self._numpy_symbols(chunk, pairs)
+            unseen = symbols >= len(table)
+            if unseen.any():
+                entries = np.where(unseen, u64(0),
+                                   table[np.where(unseen, 0, symbols)])
+            else:
+                entries = table[symbols]
+            code_lengths = (entries & u64(63)).astype(np.uint32)
+            if not code_lengths.all():
+                if self.escape is not None:
+                    # Literals are rare, so we leave them to Python
+                    return self.encode_packed(x)
+                raise KeyError(next(a for a in chunk if a not in self.codes))
+            ends = np.cumsum(code_lengths, dtype=np.uint64)
+            ends += u64(nbits & 63)
+            starts = ends - code_lengths
+            offsets = starts & u64(63)
+            codes = entries & ~u64(63)
+            # A shift by 64 gives zero, for codes that don't spill over
+            high, low = codes >> offsets, codes << (u64(64) - offsets)
+            words_at = starts >> u64(6)
+            firsts = np.flatnonzero(words_at[1:] != words_at[:-1]) + 1
+            firsts = np.concatenate([[0], firsts])
+            total = int(ends[-1])
+            words = np.zeros(((total + 63) >> 6) + 1, dtype=u64)
+            words[words_at[firsts]] = np.add.reduceat(high, firsts)
+            words[words_at[firsts] + u64(1)] += np.add.reduceat(low, firsts)
+            words[0] |= carry
+            whole = total >> 6
+            parts.append(words[:whole].astype('>u8').tobytes())
+            carry = words[whole]
+            nbits += total - (nbits & 63)
+        if nbits & 63:
+            parts.append(int(carry).to_bytes(8, 'big')[:(nbits & 63) + 7 >> 3])
+        return b''.join(parts), nbits
+
+    def encode_parallel(self, x: Union[str, bytes],
+                        workers: Optional[int] = None,
+                        block_size: int = 1 << 20,
+                        executor: Optional[Executor] = None
+                        ) -> tuple[bytes, int, BlockIndex]:
+        """Encode x in blocks of `block_size` letters in parallel.
+
+        The blocks are encoded in `workers` processes, which get the
+        encoding once when they start rather than with every block,
+        and the results are joined into the same bytes as
+        `encode_packed` gives. Returns the bytes, the number of bits
+        and the index of the blocks, so each block can be decoded on
+        its own, see `decode_parallel`. As there, an `executor` can
+        be passed to use instead of starting processes.
+
+        >>> enc = Encoding('aabacabaaa')
+        >>> enc.encode_parallel('aabacabaaa', workers=1, block_size=4)
+        (b'\\xd9x', 13, BlockIndex(offsets=[0, 5, 11], lengths=[4, 4, 2]))
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        if isinstance(x, memoryview):
+            x = byte_view(x)
+        blocks = (x[i:i + block_size] for i in range(0, len(x), block_size))
+        if not isinstance(x, str):
+            blocks = (bytes(block) for block in blocks)
+        w = BitWriter()
+        index = BlockIndex([], [min(block_size, len(x) - i)
+                                for i in range(0, len(x), block_size)])
+        parts: list[bytes] = []
+
+        def join(encoded: Iterable[tuple[bytes, int]]) -> None:
+            for data, nbits in encoded:
+                index.offsets.append(w.nbits)
+                w.write_packed(data, nbits)
+                parts.append(w.take())
+
+        if executor is not None and len(x) > block_size:
+            join(executor.map(_encode_block, blocks, itertools.repeat(self)))
+        elif workers == 1 or len(x) <= block_size:
+            join(_encode_block(block, self) for block in blocks)
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(self,)) as pool:
+                join(pool.map(_encode_block, blocks))
+        parts.append(w.close())
+        return b''.join(parts), w.nbits, index
+
+    def decode_parallel(self, x: bytes, nbits: int, index: BlockIndex,
+                        workers: Optional[int] = None,
+                        executor: Optional[Executor] = None) -> str | bytes:
+        """Decode the blocks of x in parallel, using their index.
+
+        The blocks are decoded in `workers` processes, which get the
+        encoding once when they start, and the results are joined in
+        order, so we get the same as `decode_packed`. To decode many
+        messages without starting processes for each, pass an
+        `executor` to use instead; it gets the encoding with each block.
+
+        >>> enc = Encoding('aabacabaaa')
+        >>> enc.decode_parallel(*enc.encode_parallel('aabacabaaa',
+        ...                                          block_size=4),
+        ...                     workers=1)
+        'aabacabaaa'
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        if len(index.offsets) != len(index.lengths):
+            raise ValueError("the index needs an offset for each block")
+        x = byte_view(x)
+
+        def tasks() -> Iterator[tuple[bytes, int, int, int]]:
+            for i, length in enumerate(index.lengths):
+                start, end = index.bits(i, nbits)
+                if not 0 <= start <= end <= 8 * len(x):
+                    raise ValueError("the index does not match the bits")
+                yield (bytes(x[start >> 3:(end + 7) >> 3]), start & 7,
+                       end - start, length)
+
+        if executor is not None and len(index.lengths) > 1:
+            blocks = list(executor.map(_decode_block, tasks(),
+                                       itertools.repeat(self)))
+        elif workers == 1 or len(index.lengths) <= 1:
+            blocks = [_decode_block(task, self) for task in tasks()]
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(self,)) as pool:
+                blocks = list(pool.map(_decode_block, tasks()))
+        empty = b'' if self.binary else ''
+        return empty.join(blocks)  # type: ignore[attr-defined]
+
+    def encode_stream(self, x: Union[str, Iterable[str], IO[str]],
+                      out: IO[bytes], chunk_size: int = 1 << 16) -> int:
+        """Encode x chunk by chunk, writing packed bytes to out.
+
+        x can be an iterable of strings or a text file, see
+        `read_chunks`. We only hold one chunk and its encoding in
+        memory at a time. Returns the number of bits written; the
+        last byte is padded like in `encode_packed`.
+
+        >>> out = io.BytesIO()
+        >>> Encoding('aabacabaaa').encode_stream(['aaba', 'cabaaa'], out)
+        13
+        >>> out.getvalue()
+        b'\\xd9x'
+        """
+        w = BitWriter()
+        for chunk in read_chunks(x, chunk_size):
+            w.write_all(chunk, self.codes)
+            out.write(w.take())
+        out.write(w.close())
+        return w.nbits
+
+    @cached_property
+    def _numpy_decode_table(self) -> tuple:
+        """Tables of the codes that each window of bits starts with.
+
+        A window is 16 bits, or as long as the longest code if that is
+        longer, and holds up to `per_window` codes that end inside it.
+        For each window we have the code points of its codes, how many
+        there are, where each ends, and how many bits they take up.
+        Windows that don't start with a code have no codes and take up
+        one bit, to keep lanes that started in the wrong place moving.
+        """
+        if np is None:
+            raise ImportError("the NumPy engine needs numpy installed")
+        longest = max(self.lengths.values())
+        width = max(longest, 16)
+        per_window = min(width // min(self.lengths.values()), 8) \
+            if width == 16 else 1
+        # The code point and length of the code at the start of each
+        # window of the longest code's length
+        first_points = np.zeros(1 << longest, dtype=np.uint32)
+        first_lengths = np.zeros(1 << longest, dtype=np.int64)
+        for a, (code, length) in self.codes.items():
+            start = code << (longest - length)
+            end = start + (1 << (longest - length))
+            first_points[start:end] = code_point(a)
+            first_lengths[start:end] = length
+        windows = np.arange(1 << width, dtype=np.uint64)
+        points = np.zeros((1 << width, per_window), dtype=np.uint32)
+        ends = np.zeros((1 << width, per_window), dtype=np.int64)
+        counts = np.zeros(1 << width, dtype=np.int64)
+        used = np.zeros(1 << width, dtype=np.int64)
+        going = np.ones(1 << width, dtype=bool)
+        for j in range(per_window):
+            rest = (windows << used.astype(np.uint64)) \
+                & np.uint64((1 << width) - 1)
+            first = (rest >> np.uint64(width - longest)).astype(np.int64)
+            length = first_lengths[first]
+            going &= (length > 0) & (used + length <= width)
+            points[going, j] = first_points[first[going]]
+            used[going] += length[going]
+            ends[going, j] = used[going]
+            counts += going
+        return width, points, counts, ends, np.maximum(used, 1)
+
+    def decode_numpy(self, x: bytes, nbits: int, block_bits: int = 1 << 20,
+                     lane_bits: int = 256) -> str | bytes:
+        """Decode the first `nbits` bits of x with NumPy.
+
+        This gives the same result as `decode_packed`. We split each
+        block of the input into lanes of `lane_bits` bits and decode
+        all the lanes side by side, one window of codes per step, see
+        `_numpy_decode_table`. Only the first lane starts at a known
+        code boundary, so the other lanes guess that a code starts at
+        their first bit. Huffman codes tend to fall back in step after
+        a few codes, so the lanes that started wrong are decoded again
+        from where the lane before them ended, but only until they
+        reach a position they decoded from before, since from there on
+        they know the codes. If the lanes don't fall in step after
+        `_RESYNC_PASSES` passes, as when all codes have the same length,
+        we use `decode_packed`. Needs numpy.
+
+        >>> enc = Encoding('aabacabaaa')
+        >>> enc.decode_numpy(*enc.encode_packed('aabacabaaa'))
+        'aabacabaaa'
+        """
+        if nbits > 8 * len(x):
+            raise ValueError(f"{nbits} bits requested from {len(x)} bytes")
+        if max(self.lengths.values()) > 20:
+            return decode_packed(x, nbits, self)  # The table is too big
+        width, points, counts, code_ends, steps = self._numpy_decode_table
+        shift, mask = np.uint32(32 - width), np.uint32((1 << width) - 1)
+        data = np.frombuffer(x, dtype=np.uint8)
+        parts: list = []
+        pos = 0  # Where the next code starts
+        while pos < nbits:
+            # Positions in the block count bits from the byte `first`
+            first, end = pos >> 3, min(pos + block_bits, nbits) - (pos & ~7)
+            # Big-endian 32-bit words starting at each byte, so the
+            # window at bit p is a shift of words[p // 8].
+            raw = np.zeros(((end + 7) >> 3) + 7, dtype=np.uint32)
+            chunk = data[first:first + len(raw)]
+            raw[:len(chunk)] = chunk
+            words = raw[:-3] << 24 | raw[1:-2] << 16 | raw[2:-1] << 8 | raw[3:]
+
+            bounds = np.minimum(np.arange(pos & 7, end + lane_bits, lane_bits),
+                                end)
+            nlanes = len(bounds) - 1
+            starts, limits = bounds[:-1].copy(), bounds[1:]
+            ends = np.empty(nlanes, dtype=np.int64)
+            # Where the lanes decoded a window from, and the window
+            decoded = np.zeros(end, dtype=bool)
+            windows_at = np.empty(end, dtype=np.uint32)
+
+            def run(lanes: np.ndarray, again: bool) -> np.ndarray:
+                """Decode lanes from their starts, returning the lanes
+                whose ends moved."""
+                p, limit = starts[lanes], limits[lanes]
+                new_ends = p.copy()
+                stops = limit.copy()  # Where a lane met its old windows
+                active = p < limit
+                i, p, limit = np.flatnonzero(active), p[active], limit[active]
+                found_p, found_w = [], []
+                while len(i):
+                    if again:
+                        met = decoded[p]
+                        if met.any():
+                            stops[i[met]] = p[met]
+                            new_ends[i[met]] = ends[lanes[i[met]]]
+                            i, p, limit = i[~met], p[~met], limit[~met]
+                            if not len(i):
+                                break
+                    window = (words[p >> 3]
+                              >> (shift - (p & 7).astype(np.uint32))) & mask
+                    found_p.append(p)
+                    found_w.append(window)
+                    p = p + steps[window]
+                    done = p >= limit
+                    if done.any():
+                        new_ends[i[done]] = p[done]
+                        i, p, limit = i[~done], p[~done], limit[~done]
+                if again:
+                    # Forget what the lanes decoded before they met
+                    # their old windows
+                    lows = bounds[lanes]
+                    sizes = stops - lows
+                    skips = np.repeat(lows - np.cumsum(sizes) + sizes, sizes)
+                    decoded[np.arange(len(skips)) + skips] = False
+                if found_p:
+                    found = np.concatenate(found_p)
+                    decoded[found] = True
+                    windows_at[found] = np.concatenate(found_w)
+                moved = lanes[new_ends != ends[lanes]] if again else lanes
+                ends[lanes] = new_ends
+                return moved
+
+            run(np.arange(nlanes), False)
+            redo = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+            passes = 0
+            while len(redo):
+                passes += 1
+                if passes > _RESYNC_PASSES:
+                    # The lanes don't fall in step
+                    return decode_packed(x, nbits, self)
+                starts[redo] = ends[redo - 1]
+                # A lane that now ends somewhere else moves the next one
+                redo = run(redo, True) + 1
+                redo = redo[redo < nlanes]
+                redo = redo[starts[redo] != ends[redo - 1]]
+
+            at = np.flatnonzero(decoded)
+            windows = windows_at[at]
+            n = counts[windows]
+            letters = points[windows][np.arange(points.shape[1]) < n[:, None]]
+            if self.escape is not None and \
+                    (letters == code_point(self.escape)).any():
+                # The lanes don't know about literals, so we leave
+                # messages with literals to Python
+                return decode_packed(x, nbits, self)
+            if not n.all():
+                raise ValueError("bit pattern is not a code in this encoding")
+            block_end = int(ends[-1])
+            if (first << 3) + block_end > nbits:
+                # The last window reads past the end, into the padding
+                # or beyond, so we only keep the codes that end by then
+                block_end = nbits - (first << 3)
+                last = code_ends[windows[-1], :n[-1]]
+                if block_end - int(at[-1]) not in last:
+                    raise ValueError("the bits end in the middle of a code")
+                extra = int(n[-1]) - 1 - int(
+                    np.flatnonzero(last == block_end - int(at[-1]))[0])
+                letters = letters[:len(letters) - extra]
+            if self.binary:
+                parts.append(letters.astype(np.uint8).tobytes())
+            else:
+                parts.append(letters.tobytes().decode('utf-32-le',
+                                                      'surrogatepass'))
+            pos = (first << 3) + block_end
+        return b''.join(parts) if self.binary else "".join(parts)
+
+    def decode(self, x: bits | bytes,
+               nbits: Optional[int] = None) -> str | bytes:
+        """Decode x according to this encoding.
+
+        If x is packed bytes, as returned by `encode_packed`, `nbits`
+        must give the number of bits to decode, since the padding in
+        the last byte could otherwise be read as letters. If the
+        letters are byte values, we get bytes back.
+        """
+        if isinstance(x, BYTES_TYPES):
+            if nbits is None:
+                raise ValueError("nbits is needed to decode packed bytes")
+            return decode_packed(x, nbits, self)
+        return decode(x, self)
+
+    def decode_into(self, x: bytes, nbits: int, out: bytearray,
+                    start: int = 0, chunk_size: int = 1 << 16) -> int:
+        """Decode the first `nbits` bits of x into out, from `start`.
+
+        The letters must be byte values. We decode x a chunk at a time
+        and copy the bytes into out, so out can be allocated up front
+        when we know how long the message is. Returns the number of
+        bytes written; raises ValueError if they don't fit.
+
+        >>> enc = Encoding(b'aabacabaaa')
+        >>> out = bytearray(12)
+        >>> enc.decode_into(*enc.encode_packed(b'aabacabaaa'), out, 1)
+        10
+        >>> out
+        bytearray(b'\\x00aabacabaaa\\x00')
+        """
+        if not self.binary:
+            raise TypeError("decode_into needs an encoding of bytes")
+        view = memoryview(out)
+        decoder = IncrementalDecoder(self, nbits)
+        x = byte_view(x)
+
+        def pieces() -> Iterator[bytes]:
+            for i in range(0, len(x), chunk_size):
+                yield decoder.feed(x[i:i + chunk_size])
+            yield decoder.finish()
+
+        pos = start
+        for piece in pieces():
+            if pos + len(piece) > len(view):
+                raise ValueError("the output buffer is too small")
+            view[pos:pos + len(piece)] = piece
+            pos += len(piece)
+        return pos - start
+
+
+class SampledText:
+    """
+    Encoded text with random access to its letters.
+
+    We encode x and note the bit offset of every `sample_rate`'th
+    letter, so to get letter i, or the letters from i to j, we only
+    decode from the sample before i, instead of from the start.
+
+    >>> t = SampledText('aabacabaaa', sample_rate=4)
+    >>> t.access(5), t.substring(3, 8), t[-3:], len(t)
+    ('a', 'acaba', 'aaa', 10)
+    >>> list(t.samples)
+    [0, 5, 11]
+    """
+
+    enc: Encoding
+    data: bytes         # The encoded text
+    nbits: int          # The number of bits in data
+    samples: array      # The bit offset of every sample_rate'th letter
+    sample_rate: int
+
+    def __init__(self, x: str | bytes, enc: Optional[Encoding] = None,
+                 sample_rate: int = 64):
+        """Encode x, with enc or an encoding built for x."""
+        if sample_rate < 1:
+            raise ValueError("the sample rate must be positive")
+        if isinstance(x, memoryview):
+            x = byte_view(x)
+        self.enc = Encoding(x) if enc is None else enc
+        self.sample_rate = sample_rate
+        self._length = len(x)
+        self.samples = array('Q')
+        w = BitWriter()
+        parts: list[bytes] = []
+        for i in range(0, len(x), sample_rate):
+            self.samples.append(w.nbits)
+            w.write_all(x[i:i + sample_rate], self.enc.codes)
+            if len(w.out) >= 1 << 16:
+                parts.append(w.take())
+        parts.append(w.close())
+        self.data, self.nbits = b''.join(parts), w.nbits
+
+    def __len__(self) -> int:
+        """The number of letters in the text."""
+        return self._length
+
+    def substring(self, i: int, j: int) -> str | bytes:
+        """The letters from i up to j, decoded from the sample before i."""
+        i, j = max(i, 0), min(j, len(self))
+        if i >= j:
+            return b'' if self.enc.binary else ''
+        k = self.sample_rate
+        first, last = i // k, (j - 1) // k + 1  # The samples we decode
+        start = self.samples[first]
+        end = self.samples[last] if last < len(self.samples) else self.nbits
+        length = min(last * k, len(self)) - first * k
+        decoded = _decode_block((self.data[start >> 3:(end + 7) >> 3],
+                                 start & 7, end - start, length), self.enc)
+        return decoded[i - first * k:j - first * k]
+
+    def access(self, i: int) -> letters:
+        """The letter at index i."""
+        if not -len(self) <= i < len(self):
+            raise IndexError("index out of range")
+        i %= len(self)
+        return self.substring(i, i + 1)[0]  # An int for bytes
+
+    def __getitem__(self, key: int | slice) -> letters | str | bytes:
+        """Get a letter by index, or a substring by a slice."""
+        if isinstance(key, slice):
+            i, j, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("only slices with step 1 are supported")
+            return self.substring(i, j)
+        return self.access(key)
+
+
+# The container format for encoded data. All numbers are big-endian:
+#
+#   magic      4 bytes   b'HUFF'
+#   version    uint8
+#   flags      uint8     bit 0 for bytes, bit 1 for a block index
+#   length     uint64    number of letters in the original
+#   nbits      uint64    number of bits in the payload
+#   nletters   uint32    number of letters in the model
+#   model      nletters * (uint32 code point or byte, uint8 code length)
+#   payload    (nbits + 7) // 8 bytes
+#   nblocks    uint32    number of blocks, only with a block index
+#   index      nblocks * (uint64 bit offset, uint32 number of letters)
+#   crc        uint32    CRC-32 of everything above
+#
+# The model lists the letters in canonical order, so the canonical
+# codes can be recovered from it. With the block index, the blocks of
+# the payload can be decoded in parallel.
+MAGIC = b'HUFF'
+VERSION = 1
+_HEADER = struct.Struct('>4sBBQQI')
+_MODEL_ENTRY = struct.Struct('>IB')
+_CRC = struct.Struct('>I')
+_NBLOCKS = struct.Struct('>I')
+_INDEX_ENTRY = struct.Struct('>QI')
+_FLAG_BYTES = 1
+_FLAG_INDEX = 2
+
+
+def dumps(x: str | bytes, enc: Optional[Encoding] = None,
+          block_size: Optional[int] = None,
+          workers: Optional[int] = None,
+          executor: Optional[Executor] = None) -> bytes:
+    """Encode x and wrap it in the container format.
+
+    If no encoding is given, we build a canonical one from x. The
+    encoding must be canonical, since we only store the code lengths.
+    Bytes-like x is stored as bytes and loads as bytes. With
+    `block_size`, we encode blocks of that many letters in `workers`
+    processes, and store an index of the blocks so they can be decoded
+    in parallel as well, or with `executor` if it is given.
+
+    >>> loads(dumps('aabacabaaa'))
+    'aabacabaaa'
+    >>> loads(dumps(b'aabacabaaa', block_size=4))
+    b'aabacabaaa'
+    """
+    if isinstance(x, memoryview):
+        x = byte_view(x)
+    flags = _FLAG_BYTES if isinstance(x, BYTES_TYPES) else 0
+    if enc is None:
+        enc = Encoding(x, canonical=True) if x else None
+    model = _model_entries(enc) if enc is not None else b''
+    index = b''
+    if enc is None:
+        payload, nbits = b'', 0
+    elif block_size is None:
+        payload, nbits = enc.encode_packed(x)
+    else:
+        payload, nbits, blocks = enc.encode_parallel(x, workers, block_size,
+                                                     executor)
+        flags |= _FLAG_INDEX
+        index = _NBLOCKS.pack(len(blocks.offsets)) + b''.join(
+            _INDEX_ENTRY.pack(offset, count)
+            for offset, count in zip(blocks.offsets, blocks.lengths))
+    data = b''.join([_HEADER.pack(MAGIC, VERSION, flags, len(x), nbits,
+                                  len(model) // _MODEL_ENTRY.size),
+                     model, payload, index])
+    return data + _CRC.pack(zlib.crc32(data))
+
+
+def dump(x: str | bytes, f: IO[bytes], enc: Optional[Encoding] = None,
+         block_size: Optional[int] = None,
+         workers: Optional[int] = None) -> None:
+    """Write x to the binary file f in the container format."""
+    f.write(dumps(x, enc, block_size, workers))
+
+
+def _read_exactly(f: IO[bytes], n: int) -> bytes:
+    """Read n bytes from f, or raise ValueError if it has fewer."""
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError("truncated Huffman container")
+    return data
+
+
+class _Workers:
+    """
+    A process pool for the blocks of indexed containers.
+
+    The pool is started when the first container with a block index
+    needs it, and shared by the containers after it. With no workers
+    or a single one, we encode and decode in this process instead.
+    """
+
+    def __init__(self, workers: Optional[int]):
+        """Get ready to start a pool of `workers` processes."""
+        self.workers = workers
+        self._pool: Optional[Executor] = None
+
+    def pool(self) -> Optional[Executor]:
+        """The pool, started on first use, or None to decode here."""
+        if self.workers is None or self.workers <= 1:
+            return None
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(self.workers)
+        return self._pool
+
+    def __enter__(self) -> _Workers:
+        """Use the pool in a with statement."""
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        """Shut down the pool if it was started."""
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+def load(f: IO[bytes], workers: Optional[int] = None) -> str | bytes:
+    """Read and decode one container from the binary file f.
+
+    Only the bytes of the container are read, so several containers
+    can be stored one after another in the same file. If the container
+    has a block index and `workers` is more than one, the blocks are
+    decoded in that many processes; by default we decode them here.
+    """
+    with _Workers(workers) as pool:
+        return _load_rest(f, _read_exactly(f, _HEADER.size), pool)
+
+
+def load_all(f: IO[bytes],
+             workers: Optional[int] = None) -> Iterator[str | bytes]:
+    """Read and decode the containers in f until the end of the file.
+
+    The containers share one pool of `workers` processes, see `load`.
+
+    >>> list(load_all(io.BytesIO(dumps('ab') + dumps('cd'))))
+    ['ab', 'cd']
+    """
+    with _Workers(workers) as pool:
+        while header := f.read(_HEADER.size):
+            if len(header) != _HEADER.size:
+                raise ValueError("truncated Huffman container")
+            yield _load_rest(f, header, pool)
+
+
+def _load_rest(f: IO[bytes], header: bytes,
+               workers: Optional[_Workers] = None) -> str | bytes:
+    """Read and decode the container that starts with header."""
+    magic, version, flags, length, nbits, nletters = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("not a Huffman container")
+    if version != VERSION or flags & ~(_FLAG_BYTES | _FLAG_INDEX):
+        raise ValueError(f"unsupported container version {version}")
+    model = _read_exactly(f, nletters * _MODEL_ENTRY.size)
+    payload = _read_exactly(f, (nbits + 7) // 8)
+    index = b''
+    if flags & _FLAG_INDEX:
+        nblocks = _read_exactly(f, _NBLOCKS.size)
+        index = nblocks + _read_exactly(
+            f, _NBLOCKS.unpack(nblocks)[0] * _INDEX_ENTRY.size)
+    crc, = _CRC.unpack(_read_exactly(f, _CRC.size))
+    if crc != zlib.crc32(index, zlib.crc32(
+            payload, zlib.crc32(model, zlib.crc32(header)))):
+        raise ValueError("Huffman container fails its checksum")
+    binary = bool(flags & _FLAG_BYTES)
+    if not length:
+        return b'' if binary else ''
+    enc = Encoding.from_lengths(_model_lengths(model, binary))
+    pool = workers.pool() if index and workers is not None else None
+    if pool is not None:
+        entries = list(_INDEX_ENTRY.iter_unpack(index[_NBLOCKS.size:]))
+        blocks = BlockIndex([offset for offset, _ in entries],
+                            [count for _, count in entries])
+        x = enc.decode_parallel(payload, nbits, blocks, executor=pool)
+        if len(x) != length:
+            raise ValueError("Huffman container has the wrong length")
+        return x
+    x = enc.decode(payload, nbits)
+    if len(x) != length:
+        raise ValueError("Huffman container has the wrong length")
+    return x
+
+
+def loads(data: bytes, workers: Optional[int] = None) -> str | bytes:
+    """Decode data in the container format."""
+    f = io.BytesIO(data)
+    x = load(f, workers)
+    if f.read(1):
+        raise ValueError("trailing data after Huffman container")
+    return x
+
+
+def _model_entries(enc: Encoding) -> bytes:
+    """The model of a canonical encoding, in canonical order."""
+    if not enc.canonical:
+        raise ValueError("only canonical encodings can be stored")
+    model = sorted(enc.lengths.items(), key=lambda kv: (kv[1], kv[0]))
+    if model and model[-1][1] > 255:
+        raise ValueError(f"codes of {model[-1][1]} bits can't be stored, "
+                         "the limit is 255; use max_code_length")
+    return b''.join(_MODEL_ENTRY.pack(code_point(a), length)
+                    for a, length in model)
+
+
+def _model_lengths(model: bytes, binary: bool) -> dict[letters, int]:
+    """The code lengths from the model entries of a container."""
+    return {point_letter(cp, binary): code_length
+            for cp, code_length in _MODEL_ENTRY.iter_unpack(model)}
+
+
+# A model file holds just the code lengths of an encoding, so it can
+# be trained once and used for many messages:
+#
+#   magic      4 bytes   b'HUFM'
+#   version    uint8
+#   flags      uint8     0 for text, 1 for bytes
+#   nletters   uint32    number of letters in the model
+#   model      as in the container
+#   crc        uint32    CRC-32 of everything above
+MODEL_MAGIC = b'HUFM'
+_MODEL_HEADER = struct.Struct('>4sBBI')
+
+
+def dump_model(enc: Encoding, f: IO[bytes]) -> None:
+    """Write the canonical encoding enc to the binary file f.
+
+    >>> f = io.BytesIO()
+    >>> dump_model(Encoding('aabacabaaa', canonical=True), f)
+    >>> _ = f.seek(0)
+    >>> load_model(f).lengths
+    {'a': 1, 'b': 2, 'c': 2}
+    """
+    entries = _model_entries(enc)
+    flags = _FLAG_BYTES if enc.binary else 0
+    data = _MODEL_HEADER.pack(MODEL_MAGIC, VERSION, flags,
+                              len(entries) // _MODEL_ENTRY.size) + entries
+    f.write(data + _CRC.pack(zlib.crc32(data)))
+
+
+def load_model(f: IO[bytes]) -> Encoding:
+    """Read an encoding written by `dump_model` from the binary file f."""
+    header = _read_exactly(f, _MODEL_HEADER.size)
+    magic, version, flags, nletters = _MODEL_HEADER.unpack(header)
+    if magic != MODEL_MAGIC:
+        raise ValueError("not a Huffman model")
+    if version != VERSION or flags & ~_FLAG_BYTES:
+        raise ValueError(f"unsupported model version {version}")
+    model = _read_exactly(f, nletters * _MODEL_ENTRY.size)
+    crc, = _CRC.unpack(_read_exactly(f, _CRC.size))
+    if crc != zlib.crc32(model, zlib.crc32(header)):
+        raise ValueError("Huffman model fails its checksum")
+    if not nletters:
+        raise ValueError("Huffman model has no letters")
+    return Encoding.from_lengths(_model_lengths(model, bool(flags)))
+
+
+def _human(n: float) -> str:
+    """Format a number of bytes.
+
+    >>> _human(512), _human(3 * 2**20)
+    ('512 B', '3.0 MB')
+    """
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            break
+        n /= 1024
+    return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+
+
+def _report(what: str, nin: int, nout: int, seconds: float) -> None:
+    """Write the throughput of a run to stderr."""
+    rate = nin / seconds / 2**20 if seconds > 0 else float('inf')
+    print(f"{what}: {_human(nin)} -> {_human(nout)} in {seconds:.3f}s "
+          f"({rate:.1f} MB/s)", file=sys.stderr)
+
+
+def _compress(src: IO, dst: IO[bytes], block_size: int,
+              index_interval: Optional[int] = None,
+              workers: Optional[int] = None) -> tuple[int, int]:
+    """Compress src into one container per block.
+
+    src is a text file, or a binary file whose bytes are the letters.
+    With `index_interval`, each container gets a block index with that
+    many letters per block, and the blocks of all the containers are
+    encoded in one pool of `workers` processes. Returns the number of
+    (UTF-8) bytes read and bytes written.
+    """
+    nin = nout = 0
+    with _Workers(workers) as pool:
+        for block in read_chunks(src, block_size):
+            executor = pool.pool() if index_interval \
+                and len(block) > index_interval else None
+            data = dumps(block, block_size=index_interval, workers=1,
+                         executor=executor)
+            dst.write(data)
+            nin += len(block.encode('utf-8') if isinstance(block, str)
+                       else block)
+            nout += len(data)
+    return nin, nout
+
+
+class _CountingReader:
+    """Wrap a binary file to count the bytes read from it."""
+
+    def __init__(self, f: IO[bytes]):
+        """Wrap f."""
+        self.f = f
+        self.count = 0
+
+    def read(self, n: int = -1) -> bytes:
+        """Read from the wrapped file."""
+        data = self.f.read(n)
+        self.count += len(data)
+        return data
+
+
+def _decompress(src: IO[bytes], dst: IO[str],
+                workers: Optional[int] = None) -> tuple[int, int]:
+    """Decompress all containers in src.
+
+    Containers of bytes are written to the binary buffer under dst.
+    Returns the number of bytes read and UTF-8 bytes written.
+    """
+    reader = _CountingReader(src)
+    nout = 0
+    for block in load_all(reader, workers):  # type: ignore[arg-type]
+        if isinstance(block, bytes):
+            dst.flush()
+            dst.buffer.write(block)  # type: ignore[attr-defined]
+            nout += len(block)
+            continue
+        dst.write(block)
+        nout += len(block.encode('utf-8'))
+    return reader.count, nout
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Run the command line interface, `python -m huffman`."""
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        prog='python -m huffman', description="Huffman compression.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, text in (('compress', "compress text"),
+                       ('decompress', "decompress containers"),
+                       ('stat', "show statistics for the encoding of text"),
+                       ('benchmark', "time compression and decompression")):
+        cmd = commands.add_parser(name, help=text)
+        cmd.add_argument('input', nargs='?', default='-',
+                         help="input file (default: stdin)")
+        cmd.add_argument('-o', '--output', default='-',
+                         help="output file (default: stdout)")
+        if name in ('compress', 'benchmark'):
+            cmd.add_argument('-b', '--block-size', type=int, default=1 << 20,
+                             help="letters per block (default: %(default)s)")
+        if name in ('compress', 'decompress'):
+            cmd.add_argument('-v', '--verbose', action='store_true',
+                             help="report throughput on stderr")
+            cmd.add_argument('-j', '--workers', type=int,
+                             help="processes for the indexed blocks "
+                                  "(default: one per core)")
+        if name == 'compress':
+            cmd.add_argument('-B', '--binary', action='store_true',
+                             help="compress the input as bytes, not text")
+            cmd.add_argument('-i', '--index-interval', type=int,
+                             help="add a block index with this many "
+                                  "letters per block")
+    args = parser.parse_args(argv)
+    if getattr(args, 'block_size', 1) < 1:
+        parser.error("the block size must be positive")
+    if (getattr(args, 'index_interval', None) or 1) < 1:
+        parser.error("the index interval must be positive")
+
+    text_in = args.command != 'decompress' and \
+        not getattr(args, 'binary', False)
+    if args.input == '-':
+        raw_in = sys.stdin.buffer
+    else:
+        raw_in = open(args.input, 'rb')
+    if args.output == '-':
+        raw_out = sys.stdout.buffer
+    else:
+        raw_out = open(args.output, 'wb')
+    src = io.TextIOWrapper(raw_in, encoding='utf-8', newline='') \
+        if text_in else raw_in
+    dst = raw_out if args.command == 'compress' else \
+        io.TextIOWrapper(raw_out, encoding='utf-8', newline='')
+
+    try:
+        start = time.perf_counter()
+        if args.command == 'compress':
+            nin, nout = _compress(src, dst, args.block_size,
+                                  args.index_interval,
+                                  args.workers or os.cpu_count())
+            if args.verbose:
+                _report("compress", nin, nout, time.perf_counter() - start)
+        elif args.command == 'decompress':
+            workers = args.workers or os.cpu_count()
+            nin, nout = _decompress(src, dst, workers)
+            if args.verbose:
+                _report("decompress", nin, nout, time.perf_counter() - start)
+        elif args.command == 'stat':
+            counts: Counter[str] = Counter()
+            for chunk in read_chunks(src):
+                counts.update(chunk)
+            n = sum(counts.values())
+            lengths = code_lengths(two_queue_tree(counts)) if n else {}
+            nbits = sum(counts[a] * lengths[a] for a in counts)
+            entropy = -sum(c / n * math.log2(c / n)
+                           for c in counts.values()) if n else 0.0
+            print(f"letters:        {n}", file=dst)
+            print(f"alphabet:       {len(counts)}", file=dst)
+            print(f"entropy:        {entropy:.4f} bits/letter", file=dst)
+            print(f"code length:    {nbits / n if n else 0:.4f} bits/letter",
+                  file=dst)
+            print(f"longest code:   {max(lengths.values(), default=0)} bits",
+                  file=dst)
+            print(f"encoded size:   {_human((nbits + 7) // 8)}", file=dst)
+        else:
+            x = src.read()
+            start = time.perf_counter()
+            packed = io.BytesIO()
+            size, nout = _compress(io.StringIO(x), packed, args.block_size)
+            middle = time.perf_counter()
+            packed.seek(0)
+            out = io.StringIO()
+            _decompress(packed, out)
+            end = time.perf_counter()
+            if out.getvalue() != x:
+                raise RuntimeError("decompression did not restore the input")
+            for what, seconds, before, after in (
+                    ("compress", middle - start, size, nout),
+                    ("decompress", end - middle, nout, size)):
+                rate = size / max(seconds, 1e-9) / 2**20
+                print(f"{what + ':':<12}{_human(before)} -> "
+                      f"{_human(after)} in {seconds:.3f}s "
+                      f"({rate:.1f} MB/s)", file=dst)
+            print(f"{'ratio:':<12}{nout / size if size else 0:.3f}", file=dst)
+    finally:
+        dst.flush()
+        # Detach the text wrappers so they don't close stdin and stdout
+        for wrapper in (src, dst):
+            if isinstance(wrapper, io.TextIOWrapper):
+                wrapper.detach()
+        if args.input != '-':
+            raw_in.close()
+        if args.output != '-':
+            raw_out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""Tests for adaptive Huffman coding."""
+
+import io
+
+import pytest
+
+from adaptive import (
+    AdaptiveDecoder, AdaptiveEncoder, adaptive_decode, adaptive_encode,
+    encode_stream
+)
+
+
+def test_round_trip() -> None:
+    """Text and bytes decode to what was encoded."""
+    for x in ("", "a", "aaaa", "mississippi river æøå " * 30):
+        assert adaptive_decode(*adaptive_encode(x)) == x
+    x = bytes(i * i % 251 for i in range(3000))
+    assert adaptive_decode(*adaptive_encode(x), binary=True) == x
+
+
+def test_sibling_property() -> None:
+    """The nodes stay ordered by weight, with siblings side by side."""
+    enc = AdaptiveEncoder()
+    enc.encode("".join(chr(97 + i % 23) * (i % 5 + 1) for i in range(500)))
+    tree = enc.tree
+    weights = [tree.weight[node] for node in tree.order]
+    assert weights == sorted(weights, reverse=True)
+    for node, left in enumerate(tree.left):
+        if left >= 0:
+            right = tree.right[node]
+            assert tree.weight[node] == tree.weight[left] + tree.weight[right]
+            assert abs(tree.rank[left] - tree.rank[right]) == 1
+
+
+def test_streaming() -> None:
+    """Chunks can be encoded and decoded as they arrive."""
+    x = "to be or not to be, that is the question. " * 50
+    out = io.BytesIO()
+    nbits = encode_stream(iter(x.split(" ")), out, chunk_size=3)
+    data = out.getvalue()
+    dec = AdaptiveDecoder()
+    pieces = [dec.feed(data[i:i + 5]) for i in range(0, len(data), 5)]
+    assert "".join(pieces) + dec.finish(nbits) == x.replace(" ", "")
+    with pytest.raises(ValueError):
+        adaptive_decode(data, nbits - 1)
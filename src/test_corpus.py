@@ -0,0 +1,33 @@
+"""Tests for the synthetic corpora, and Huffman coding on them."""
+
+import pytest
+
+from corpus import KINDS, corpus, generate
+from huffman import Encoding, loads, dumps
+
+
+@pytest.mark.parametrize("kind", list(KINDS))
+def test_deterministic(kind: str) -> None:
+    """The same seed gives the same corpus, of the size we asked for."""
+    x = corpus(kind, 3000, seed=1, chunk_size=1000)
+    assert len(x) == 3000
+    assert x == corpus(kind, 3000, seed=1, chunk_size=1000)
+    assert x != corpus(kind, 3000, seed=2, chunk_size=1000) \
+        or kind == 'single'
+    assert [len(chunk) for chunk in generate(kind, 2500, chunk_size=1000)] \
+        == [1000, 1000, 500]
+
+
+@pytest.mark.parametrize("kind", list(KINDS))
+def test_round_trip(kind: str) -> None:
+    """Every kind of corpus survives encoding and decoding."""
+    x = corpus(kind, 20_000, seed=3)
+    enc = Encoding(x)
+    assert enc.decode(*enc.encode_packed(x)) == x
+    assert loads(dumps(x)) == x
+
+
+def test_fibonacci_depth() -> None:
+    """Fibonacci counts give the longest codes an alphabet can have."""
+    enc = Encoding(corpus('fibonacci', 10_000))
+    assert max(enc.lengths.values()) == len(enc.lengths) - 1
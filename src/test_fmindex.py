@@ -0,0 +1,56 @@
+"""Tests for FM-indexes."""
+
+import random
+
+from corpus import corpus
+from fmindex import FMIndex, suffix_array
+
+
+def occurrences(x, p):
+    """The positions of p in x, by brute force."""
+    return [i for i in range(len(x) + 1) if x.startswith(p, i)]
+
+
+def test_suffix_array() -> None:
+    """The suffix array sorts the suffixes."""
+    rng = random.Random(2)
+    for n in (0, 1, 2, 10, 300):
+        x = "".join(rng.choice("ab") for _ in range(n))
+        assert suffix_array(x) == sorted(range(n), key=lambda i: x[i:])
+    assert suffix_array(b"aaaa") == [3, 2, 1, 0]
+
+
+def test_count_and_locate() -> None:
+    """Count and locate agree with searching the text."""
+    x = corpus('english', 5000, seed=3)
+    fm = FMIndex(x, sample_rate=8)
+    rng = random.Random(4)
+    for _ in range(200):
+        i = rng.randrange(len(x))
+        p = x[i:i + rng.randrange(1, 8)]
+        assert fm.locate(p) == occurrences(x, p)
+        assert fm.count(p) == len(fm.locate(p))
+    assert fm.count("#") == fm.count("zzzzzzzz") == 0
+    assert fm.locate("") == list(range(len(x) + 1))
+
+
+def test_reads() -> None:
+    """Reads joined by newlines can be searched as bytes."""
+    rng = random.Random(5)
+    reads = [corpus('dna', 100, seed=i).encode() for i in range(50)]
+    x = b"\n".join(reads)
+    fm = FMIndex(x)
+    for _ in range(50):
+        read = rng.choice(reads)
+        i = rng.randrange(90)
+        p = read[i:i + 10]
+        assert fm.locate(p) == occurrences(x, p)
+    assert fm.nbits() < 8 * len(x)
+
+
+def test_small_texts() -> None:
+    """Empty texts and texts of a single letter."""
+    fm = FMIndex("")
+    assert len(fm) == 0 and fm.count("") == 1 and fm.count("a") == 0
+    fm = FMIndex("aaaa", sample_rate=3)
+    assert fm.locate("aa") == [0, 1, 2] and fm.count("aaaaa") == 0
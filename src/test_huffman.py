@@ -1,6 +1,32 @@
 """Test Huffman coding"""
 
-from huffman import Encoding
+import io
+import pickle
+from collections import Counter
+import pytest
+from huffman import (
+    Encoding, FlatTree, IncrementalDecoder, MAGIC, SampledText,
+    build_code_table, build_encoding_table, count_letters, dump, dump_model,
+    dumps, flatten, load, load_all, load_model, loads, main, np,
+    two_queue_tree
+)
+
+
+def fibonacci_counts(k: int, first: str = 'A') -> dict[str, int]:
+    """k letters from first on, counted by the Fibonacci numbers.
+
+    These counts give the deepest Huffman trees there are.
+    """
+    counts = [1, 1][:k]
+    while len(counts) < k:
+        counts.append(counts[-1] + counts[-2])
+    return {chr(ord(first) + i): c for i, c in enumerate(counts)}
+
+
+def runs(n: int, alphabet: int, longest: int, first: str = 'a') -> str:
+    """n runs, cycling through the letters from first and the lengths."""
+    return "".join(chr(ord(first) + i % alphabet) * (i % longest + 1)
+                   for i in range(n))
 
 
 def test_minimal() -> None:
@@ -8,3 +34,391 @@ def test_minimal() -> None:
     x = "aabacabaaa"
     enc = Encoding(x)
     assert x == enc.decode(enc.encode(x))
+
+
+def test_packed() -> None:
+    """Packed encoding round-trips and uses a bit per bit."""
+    x = "aabacabaaa" * 100 + "xyz"
+    enc = Encoding(x)
+    data, nbits = enc.encode_packed(x)
+    assert nbits == len(enc.encode(x))
+    assert len(data) == (nbits + 7) // 8
+    assert x == enc.decode(data, nbits)
+
+
+def test_decode_long_codes() -> None:
+    """Codes longer than the lookup window go through sub-tables."""
+    x = "".join(a * c for a, c in fibonacci_counts(25).items())
+    enc = Encoding(x)
+    assert enc.decode_table.max_length > enc.decode_table.bits
+    assert x == enc.decode(enc.encode(x))
+    data, nbits = enc.encode_packed(x)
+    assert x == enc.decode(data, nbits)
+
+
+def test_single_letter() -> None:
+    """A one-letter alphabet still needs a bit per letter."""
+    x = "aaaa"
+    enc = Encoding(x)
+    assert enc.encode(x) == "0000"
+    assert x == enc.decode(enc.encode(x))
+
+
+def test_canonical() -> None:
+    """Canonical codes only depend on the code lengths."""
+    x = "the quick brown fox jumps over the lazy dog" * 10
+    enc = Encoding(x, canonical=True)
+    assert enc.lengths == Encoding(x).lengths
+    assert x == enc.decode(enc.encode(x))
+    other = Encoding.from_lengths(enc.lengths)
+    assert other.table == enc.table
+    data, nbits = enc.encode_packed(x)
+    assert x == other.decode(data, nbits)
+
+
+def test_max_code_length() -> None:
+    """Length-limited codes stay within the limit and round-trip."""
+    x = "".join(a * c for a, c in fibonacci_counts(20).items())
+    assert max(Encoding(x).lengths.values()) == 19
+    enc = Encoding(x, max_code_length=8)
+    assert max(enc.lengths.values()) == 8
+    assert enc.canonical
+    data, nbits = enc.encode_packed(x)
+    assert x == enc.decode(data, nbits)
+    with pytest.raises(ValueError):
+        Encoding("abcde", max_code_length=2)
+
+
+def test_two_queue() -> None:
+    """The two-queue builder gives codes as good as the heap builder."""
+    x = runs(200, 20, 37)
+    heap = Encoding(x, method="heap")
+    queue = Encoding(x, method="two-queue")
+    assert len(heap.encode(x)) == len(queue.encode(x))
+    assert x == queue.decode(queue.encode(x))
+    with pytest.raises(ValueError):
+        Encoding(x, method="magic")
+
+
+def test_encode_stream() -> None:
+    """Streaming gives the same bytes as encoding everything at once."""
+    x = runs(1000, 7, 5)
+    enc = Encoding(x)
+    out = io.BytesIO()
+    nbits = enc.encode_stream(io.StringIO(x), out, chunk_size=7)
+    assert (out.getvalue(), nbits) == enc.encode_packed(x)
+
+
+def test_incremental_decoder() -> None:
+    """Codes split across chunks are decoded once the rest arrives."""
+    x = runs(500, 11, 4)
+    enc = Encoding(x)
+    data, nbits = enc.encode_packed(x)
+    for nbits_given in (nbits, None):
+        decoder = IncrementalDecoder(enc, nbits_given)
+        parts = [decoder.feed(data[i:i + 3]) for i in range(0, len(data), 3)]
+        parts.append(decoder.finish(None if nbits_given else nbits))
+        assert x == "".join(parts)
+    decoder = IncrementalDecoder(enc, nbits)
+    decoder.feed(data[:-1])
+    with pytest.raises(ValueError):
+        decoder.finish()
+
+
+def test_container() -> None:
+    """Containers round-trip without the original encoding."""
+    x = "mississippi river æøå"
+    data = dumps(x)
+    assert data.startswith(MAGIC)
+    assert loads(data) == x
+    assert loads(dumps("")) == ""
+    assert loads(dumps(x, Encoding(x + "z", canonical=True))) == x
+    with pytest.raises(ValueError):
+        dumps(x, Encoding(x))
+
+    f = io.BytesIO()
+    dump(x, f)
+    dump("aaa", f)
+    f.seek(0)
+    assert (load(f), load(f)) == (x, "aaa")
+
+    corrupted = bytearray(data)
+    corrupted[-6] ^= 1
+    with pytest.raises(ValueError):
+        loads(bytes(corrupted))
+    with pytest.raises(ValueError):
+        loads(data[:-1])
+
+
+def test_command_line(tmp_path, capsys) -> None:
+    """Compressing and decompressing files gives back the original."""
+    x = "to be or not to be\nthat is the question\n" * 20
+    original = tmp_path / "x.txt"
+    original.write_text(x, encoding='utf-8')
+    packed, unpacked = tmp_path / "x.huf", tmp_path / "y.txt"
+    assert main(['compress', '-b', '100', str(original),
+                 '-o', str(packed)]) == 0
+    assert main(['decompress', str(packed), '-o', str(unpacked)]) == 0
+    assert unpacked.read_text(encoding='utf-8') == x
+    assert main(['compress', '-i', '30', str(original),
+                 '-o', str(packed)]) == 0
+    assert main(['decompress', '-j', '2', str(packed),
+                 '-o', str(unpacked)]) == 0
+    assert unpacked.read_text(encoding='utf-8') == x
+    assert main(['stat', str(original)]) == 0
+    assert "alphabet:       14" in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        main(['stat', '-b', '100', str(original)])
+
+
+def test_encode_numpy() -> None:
+    """The NumPy encoder gives the same bytes as the Python one."""
+    pytest.importorskip("numpy")
+    x = runs(3000, 13, 7, '\u03b1')
+    enc = Encoding(x)
+    assert enc.encode_numpy(x, chunk_size=1000) == enc.encode_packed(x)
+    with pytest.raises(KeyError):
+        enc.encode_numpy(x + "?")
+    # Small alphabets are looked up two letters at a time
+    y = "the quick brown fox jumps over the lazy dog \udcff" * 100
+    enc = Encoding(y)
+    assert enc.encode_numpy(y, chunk_size=333) == enc.encode_packed(y)
+    with pytest.raises(KeyError):
+        enc.encode_numpy(y + "\u1234")
+    z = y.encode('utf-8', 'surrogateescape')
+    enc = Encoding(z)
+    assert enc.encode_numpy(z, chunk_size=333) == enc.encode_packed(z)
+    deep = Encoding.from_counts(fibonacci_counts(70))
+    x = "".join(deep.codes)
+    assert max(deep.lengths.values()) > 64
+    assert deep.encode_numpy(x) == deep.encode_packed(x)
+
+
+def test_decode_numpy() -> None:
+    """The NumPy decoder agrees with the Python one across lanes."""
+    pytest.importorskip("numpy")
+    x = runs(3000, 13, 7, '\u03b1')
+    enc = Encoding(x)
+    data, nbits = enc.encode_packed(x)
+    assert enc.decode_numpy(data, nbits) == x
+    assert enc.decode_numpy(data, nbits, block_bits=1000, lane_bits=3) == x
+    with pytest.raises(ValueError):
+        enc.decode_numpy(data, nbits - 1)
+    # Lanes that start in the wrong place never fall in step when all
+    # codes have the same length, and this used to take quadratic time.
+    x = bytes(b'abcdefgh'[(i * 2654435761 >> 7) % 8] for i in range(400_000))
+    enc = Encoding(x)
+    assert set(enc.lengths.values()) == {3}
+    assert enc.decode_numpy(*enc.encode_packed(x)) == x
+    x = "abc\udcffd" * 1000
+    enc = Encoding(x)
+    assert enc.decode_numpy(*enc.encode_packed(x)) == x
+
+
+def test_flat_tree() -> None:
+    """Flat trees give codes as good as the object trees and pickle."""
+    x = runs(400, 17, 9)
+    enc = Encoding(x, flat=True)
+    assert isinstance(enc.tree, FlatTree)
+    assert len(enc.encode(x)) == len(Encoding(x).encode(x))
+    assert x == enc.decode(enc.encode(x))
+    tree = pickle.loads(pickle.dumps(enc.tree))
+    assert build_encoding_table(tree) == enc.table
+    assert build_encoding_table(flatten(Encoding(x).tree)) == Encoding(x).table
+
+
+def test_deep_code_table() -> None:
+    """Trees deeper than the recursion limit still get code tables."""
+    tree = two_queue_tree(fibonacci_counts(1500, '\u0100'))
+    codes = build_code_table(tree)
+    assert max(length for _, length in codes.values()) == 1499
+    table = build_encoding_table(tree)
+    assert table == build_encoding_table(tree)
+    assert all(len(table[a]) == length for a, (_, length) in codes.items())
+
+
+def test_count_letters() -> None:
+    """All counting backends agree with Counter."""
+    x = runs(40000, 23, 5)
+    expected = dict(sorted(Counter(x).items()))
+    assert count_letters(x) == expected
+    assert count_letters(x, workers=2, chunk_size=10000) == expected
+    data = x.encode('utf-8')
+    expected_bytes = dict(sorted(Counter(data).items()))
+    assert count_letters(data) == expected_bytes
+    assert count_letters(memoryview(data)) == expected_bytes
+    assert count_letters(data, workers=2, chunk_size=10000) == expected_bytes
+
+    # Lone surrogates, as from surrogateescape, are letters too
+    y = "abc" * 30000 + b"\xff".decode('utf-8', 'surrogateescape')
+    assert count_letters(y) == dict(sorted(Counter(y).items()))
+    enc = Encoding(y)
+    assert enc.decode(*enc.encode_packed(y)) == y
+
+
+def test_bytes(tmp_path) -> None:
+    """Bytes round-trip as bytes, through every encoder and decoder."""
+    x = bytes(i * i % 251 for i in range(5000)) + bytes(range(256))
+    enc = Encoding(memoryview(x), canonical=True)
+    assert enc.binary and set(enc.codes) == set(range(256))
+    data, nbits = enc.encode_packed(memoryview(x))
+    assert (data, nbits) == enc.encode_packed(bytearray(x))
+    assert enc.decode(data, nbits) == x
+    assert enc.decode(enc.encode(x)) == x
+    out = bytearray(len(x))
+    assert enc.decode_into(data, nbits, out, chunk_size=7) == len(x)
+    assert out == x
+    with pytest.raises(ValueError):
+        enc.decode_into(data, nbits, bytearray(10))
+    assert loads(dumps(x)) == x and loads(dumps(b'')) == b''
+
+    original, packed, unpacked = (tmp_path / name for name in "xyz")
+    original.write_bytes(x)
+    assert main(['compress', '-B', str(original), '-o', str(packed)]) == 0
+    assert main(['decompress', str(packed), '-o', str(unpacked)]) == 0
+    assert unpacked.read_bytes() == x
+
+    pytest.importorskip("numpy")
+    assert enc.encode_numpy(x) == (data, nbits)
+    assert enc.decode_numpy(data, nbits, lane_bits=64) == x
+
+
+def test_pretrained(tmp_path) -> None:
+    """A model trained once encodes many messages and survives a file."""
+    records = [f"id={i};name=user{i % 7};ok={i % 2 == 0}" for i in range(50)]
+    enc = Encoding.from_corpus(records, canonical=True)
+    assert enc.lengths == Encoding.from_counts(
+        Counter("".join(records)), canonical=True).lengths
+    for record in records[:5] + ["name=user0"]:
+        assert enc.decode(*enc.encode_packed(record)) == record
+        assert loads(dumps(record, enc)) == record
+
+    path = tmp_path / "model.huf"
+    with open(path, 'wb') as f:
+        dump_model(enc, f)
+    with open(path, 'rb') as f:
+        assert load_model(f).codes == enc.codes
+    with pytest.raises(ValueError):
+        dump_model(Encoding(records[0]), io.BytesIO())
+    deep = Encoding.from_counts(fibonacci_counts(300), canonical=True)
+    with pytest.raises(ValueError, match="255"):
+        dump_model(deep, io.BytesIO())
+    with pytest.raises(ValueError, match="255"):
+        dumps("AB", deep)
+
+    # A model for any byte, trained on a few of them
+    counts = Counter(b'hello world')
+    full = Encoding.from_counts({b: counts[b] for b in range(256)},
+                                canonical=True)
+    assert max(full.lengths.values()) <= 16
+    f = io.BytesIO()
+    dump_model(full, f)
+    f.seek(0)
+    assert load_model(f).codes == full.codes
+    x = bytes(range(256)) + b'hello world'
+    assert loads(dumps(x, full)) == x
+    if np is not None:
+        assert full.encode_numpy(x) == full.encode_packed(x)
+
+    binary = Encoding.from_corpus([b'abc', b'cba'], canonical=True)
+    f = io.BytesIO()
+    dump_model(binary, f)
+    f.seek(0)
+    assert load_model(f).decode(*binary.encode_packed(b'cab')) == b'cab'
+
+
+def test_escape() -> None:
+    """Letters the encoding has not seen go through the escape."""
+    enc = Encoding.from_corpus(["hello world"] * 3, canonical=True,
+                               escape=True)
+    x = "Hello, wörld! \U0001f600"
+    data, nbits = enc.encode_packed(x)
+    assert enc.decode(data, nbits) == enc.decode(enc.encode(x)) == x
+    decoder = IncrementalDecoder(enc)
+    pieces = [decoder.feed(data[i:i + 1]) for i in range(len(data))]
+    assert "".join(pieces) + decoder.finish(nbits) == x
+    assert loads(dumps(x, enc)) == x
+    f = io.BytesIO()
+    dump_model(enc, f)
+    f.seek(0)
+    assert load_model(f).decode(data, nbits) == x
+    with pytest.raises(KeyError):
+        Encoding("hello world").encode_packed(x)
+
+    binary = Encoding(b"abc", escape=True)
+    assert binary.decode(*binary.encode_packed(b"a\x00b\xff")) == b"a\x00b\xff"
+
+    pytest.importorskip("numpy")
+    assert enc.encode_numpy(x) == (data, nbits)
+    assert enc.decode_numpy(data, nbits) == x
+
+
+def test_encode_parallel() -> None:
+    """Blocks encoded in worker processes join up like one encoding."""
+    x = runs(2000, 13, 7, '\u03b1')
+    enc = Encoding(x, escape=True)
+    x += "?"  # Goes through the escape
+    data, nbits, index = enc.encode_parallel(x, workers=2, block_size=1000)
+    assert (data, nbits) == enc.encode_packed(x)
+    blocks = [x[i:i + 1000] for i in range(0, len(x), 1000)]
+    ends = index.offsets[1:] + [nbits]
+    assert [end - start for start, end in zip(index.offsets, ends)] == \
+        [enc.encode_packed(block)[1] for block in blocks]
+    assert index.lengths == [len(block) for block in blocks]
+    assert enc.encode_parallel("", workers=2)[:2] == (b"", 0)
+
+
+def test_decode_parallel(tmp_path, monkeypatch) -> None:
+    """Blocks found through the index decode in worker processes."""
+    x = bytes(i * i % 251 for i in range(5000))
+    enc = Encoding(x)
+    data, nbits, index = enc.encode_parallel(x, block_size=999)
+    assert enc.decode_parallel(data, nbits, index, workers=2) == x
+    assert enc.decode_parallel(data, nbits, index, workers=1) == x
+    index.lengths[0] += 1
+    with pytest.raises(ValueError):
+        enc.decode_parallel(data, nbits, index, workers=1)
+
+    y = "mississippi river æøå" * 200
+    packed = dumps(y, block_size=500, workers=2)
+    assert loads(packed, workers=2) == loads(packed, workers=1) == y
+    assert loads(packed) == y and len(packed) > len(dumps(y))
+
+    # The containers of a file share one pool
+    import concurrent.futures
+    pools = []
+
+    class Pool(concurrent.futures.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', Pool)
+    assert list(load_all(io.BytesIO(packed * 3))) == [y] * 3 and not pools
+    assert list(load_all(io.BytesIO(packed * 3), workers=2)) == [y] * 3
+    assert len(pools) == 1
+    original, compressed = tmp_path / "y.txt", tmp_path / "y.huf"
+    original.write_text(y * 3, encoding='utf-8')
+    assert main(['compress', '-b', str(len(y)), '-i', '500', '-j', '2',
+                 str(original), '-o', str(compressed)]) == 0
+    assert len(pools) == 2
+    with open(compressed, 'rb') as f:
+        assert list(load_all(f)) == [y] * 3
+
+
+def test_sampled_text() -> None:
+    """Letters and substrings come out right from any position."""
+    x = runs(300, 13, 7, '\u03b1')
+    for sample_rate in (1, 7, 64, 5000):
+        t = SampledText(x, sample_rate=sample_rate)
+        assert "".join(t[i] for i in range(len(t))) == x
+        for i, j in ((0, len(x)), (5, 6), (10, 500), (len(x) - 3, 10**9),
+                     (40, 30)):
+            assert t.substring(i, j) == x[i:j]
+        assert t[-1] == x[-1] and t[100:200] == x[100:200]
+    with pytest.raises(IndexError):
+        t[len(x)]
+
+    y = bytes(range(256)) * 3  # Mostly escaped letters
+    t = SampledText(y, Encoding(b"abc", escape=True), sample_rate=10)
+    assert t[300] == y[300] and t[250:270] == y[250:270]
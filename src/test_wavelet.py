@@ -0,0 +1,55 @@
+"""Tests for Huffman-shaped wavelet trees."""
+
+import random
+
+import pytest
+
+from corpus import corpus
+from huffman import Encoding
+from wavelet import BitVector, WaveletTree
+
+
+def test_bit_vector() -> None:
+    """Rank and select agree with counting, across rank blocks."""
+    rng = random.Random(1)
+    bits = "".join(rng.choice("0001") for _ in range(2000))
+    v = BitVector(bits)
+    assert len(v) == len(bits)
+    for i in range(0, len(bits) + 1, 37):
+        assert v.rank(1, i) == bits[:i].count("1")
+        assert v.rank(0, i) == bits[:i].count("0")
+    for bit in "01":
+        where = [i for i, b in enumerate(bits) if b == bit]
+        for k in range(1, len(where) + 1, 13):
+            assert v.select(int(bit), k) == where[k - 1]
+        with pytest.raises(ValueError):
+            v.select(int(bit), len(where) + 1)
+
+
+def test_wavelet_tree() -> None:
+    """Access, rank and select answer like the string would."""
+    x = corpus('english', 3000, seed=5)
+    w = WaveletTree(x)
+    assert "".join(w[i] for i in range(len(x))) == x
+    for a in set(x):
+        where = [i for i, b in enumerate(x) if b == a]
+        assert [w.select(a, k) for k in range(1, len(where) + 1)] == where
+        for i in range(0, len(x) + 1, 101):
+            assert w.rank(a, i) == x[:i].count(a)
+    assert w.rank("#", 100) == 0
+    with pytest.raises(ValueError):
+        w.select("#", 1)
+
+
+def test_wavelet_size() -> None:
+    """The bit vectors hold as many bits as the Huffman encoding."""
+    x = corpus('dna', 20_000)
+    enc = Encoding(x)
+    w = WaveletTree(x, enc)
+    nbits = enc.encode_packed(x)[1]
+    assert sum(len(v) for v in w.nodes.values()) == nbits
+    assert w.nbits() < 1.1 * nbits
+
+    y = bytes([7]) * 10 + b"ACGT"
+    w = WaveletTree(y)
+    assert w[3] == 7 and w.rank(7, 12) == 10 and w.select(65, 1) == 10
@@ -0,0 +1,214 @@
+"""
+Huffman-shaped wavelet trees.
+
+A wavelet tree stores a string as bit vectors, one for each inner
+node of a code tree. The bit vector of a node has a bit for each
+letter, in order, whose code goes through the node: the next bit of
+its code. Shaped like the Huffman tree, the bit vectors hold exactly
+the bits of the Huffman encoding, so about H0 bits per letter, but
+with rank and select on the bit vectors we can also get any letter,
+count the occurrences of a letter in a prefix, and find the k'th
+occurrence of a letter, all without decoding the string.
+"""
+
+from __future__ import annotations
+from array import array
+from bisect import bisect_left
+from typing import Optional, Union
+
+from huffman import Encoding, letters
+
+# Bits per block of the rank samples
+BLOCK_BITS = 512
+
+
+class BitVector:
+    """
+    A bit vector with rank and select.
+
+    The bits are packed most significant bit first, and we keep the
+    number of ones before each block of `BLOCK_BITS` bits, which costs
+    32 bits per block. Rank adds up the ones in the rest of the block
+    with `int.bit_count`.
+
+    >>> v = BitVector('0110100111')
+    >>> v[1], v.rank(1, 5), v.rank(0, 5), v.select(1, 4), v.select(0, 2)
+    (1, 3, 2, 7, 3)
+    """
+
+    data: bytes      # The packed bits
+    ranks: array     # The number of ones before each block
+
+    def __init__(self, bits: Union[str, bytes, bytearray]):
+        """Pack a string of '0' and '1' characters."""
+        self._length = len(bits)
+        if not bits:
+            self.data = b''
+        else:
+            padded = bits + (b'0' if isinstance(bits, (bytes, bytearray))
+                             else '0') * (-len(bits) % 8)
+            self.data = int(padded, 2).to_bytes(len(padded) // 8, 'big')
+        block_bytes = BLOCK_BITS // 8
+        self.ranks = array('I', [0])
+        for start in range(0, len(self.data), block_bytes):
+            block = self.data[start:start + block_bytes]
+            self.ranks.append(self.ranks[-1]
+                              + int.from_bytes(block, 'big').bit_count())
+
+    def __len__(self) -> int:
+        """The number of bits."""
+        return self._length
+
+    def __getitem__(self, i: int) -> int:
+        """The bit at index i."""
+        if not 0 <= i < self._length:
+            raise IndexError("bit index out of range")
+        return self.data[i >> 3] >> (7 - (i & 7)) & 1
+
+    def rank(self, bit: int, i: int) -> int:
+        """The number of bits equal to `bit` before index i."""
+        block = i // BLOCK_BITS
+        ones = self.ranks[block] + int.from_bytes(
+            self.data[block * (BLOCK_BITS // 8):i >> 3], 'big').bit_count()
+        if i & 7:
+            ones += (self.data[i >> 3] >> (8 - (i & 7))).bit_count()
+        return ones if bit else i - ones
+
+    def select(self, bit: int, k: int) -> int:
+        """The index of the k'th bit equal to `bit`, counting from one.
+
+        Raises ValueError if there are fewer than k of them.
+        """
+        if not 1 <= k <= self.rank(bit, self._length):
+            raise ValueError(f"there are fewer than {k} {bit}-bits")
+        ranks = self.ranks
+        # The last block with fewer than k of the bits before it
+        if bit:
+            block = bisect_left(ranks, k) - 1
+            seen = ranks[block]
+        else:
+            block = bisect_left(range(len(ranks)), k, key=lambda b:
+                                b * BLOCK_BITS - ranks[b]) - 1
+            seen = block * BLOCK_BITS - ranks[block]
+        # Skip whole words, then whole bytes, then bits
+        i = block * (BLOCK_BITS // 8)
+        while True:
+            word = self.data[i:i + 8]
+            count = int.from_bytes(word, 'big').bit_count()
+            if not bit:
+                count = 8 * len(word) - count
+            if seen + count >= k:
+                break
+            seen += count
+            i += 8
+        while True:
+            byte = self.data[i] if bit else ~self.data[i] & 0xff
+            if seen + byte.bit_count() >= k:
+                break
+            seen += byte.bit_count()
+            i += 1
+        for j in range(8):
+            seen += byte >> (7 - j) & 1
+            if seen == k:
+                return 8 * i + j
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    def nbits(self) -> int:
+        """The number of bits used, including the rank samples."""
+        return 8 * len(self.data) + 32 * len(self.ranks)
+
+
+class WaveletTree:
+    """
+    A wavelet tree shaped like the Huffman tree of the string.
+
+    Nodes are named by the code prefix that leads to them, as the bits
+    of the prefix and its length.
+
+    >>> w = WaveletTree('abracadabra')
+    >>> w.access(4), w.rank('a', 8), w.select('a', 4), w.select('r', 2)
+    ('c', 4, 7, 9)
+    >>> w.access_rank(7)
+    ('a', 3)
+    """
+
+    enc: Encoding
+    nodes: dict[tuple[int, int], BitVector]  # Bit vectors of the nodes
+    leaves: dict[tuple[int, int], letters]   # Letters by their codes
+
+    def __init__(self, x: Union[str, bytes], enc: Optional[Encoding] = None):
+        """Build the wavelet tree for x, shaped by enc or x's encoding.
+
+        Every letter of x must have a code in enc.
+        """
+        self.enc = Encoding(x) if enc is None else enc
+        codes = dict(self.enc.codes)  # Not through an escape
+        self._length = len(x)
+        self.leaves = {code: a for a, code in codes.items()}
+        bits: dict[tuple[int, int], bytearray] = {}
+        # The nodes each letter's code passes through, and its bits
+        paths = {a: [(bits.setdefault((code >> (length - d), d), bytearray()),
+                      48 + (code >> (length - d - 1) & 1))
+                     for d in range(length)]
+                 for a, (code, length) in codes.items()}
+        for a in x:
+            for node_bits, bit in paths[a]:
+                node_bits.append(bit)
+        self.nodes = {node: BitVector(node_bits)
+                      for node, node_bits in bits.items()}
+
+    def __len__(self) -> int:
+        """The number of letters."""
+        return self._length
+
+    def access_rank(self, i: int) -> tuple[letters, int]:
+        """The letter a at index i and the number of a's before i.
+
+        We get the rank on the way down to the leaf, so this costs the
+        same as `access`.
+        """
+        if not 0 <= i < self._length:
+            raise IndexError("index out of range")
+        prefix = depth = 0
+        while (prefix, depth) not in self.leaves:
+            vector = self.nodes[prefix, depth]
+            bit = vector[i]
+            i = vector.rank(bit, i)
+            prefix, depth = prefix << 1 | bit, depth + 1
+        return self.leaves[prefix, depth], i
+
+    def access(self, i: int) -> letters:
+        """The letter at index i."""
+        return self.access_rank(i)[0]
+
+    __getitem__ = access
+
+    def rank(self, a: letters, i: int) -> int:
+        """The number of occurrences of a before index i."""
+        if a not in self.enc.lengths:
+            return 0
+        code, length = self.enc.codes[a]
+        i = max(0, min(i, self._length))
+        for d in range(length):
+            bit = code >> (length - d - 1) & 1
+            i = self.nodes[code >> (length - d), d].rank(bit, i)
+        return i
+
+    def select(self, a: letters, k: int) -> int:
+        """The index of the k'th occurrence of a, counting from one.
+
+        Raises ValueError if a occurs fewer than k times.
+        """
+        if a not in self.enc.lengths:
+            raise ValueError(f"{a!r} does not occur")
+        code, length = self.enc.codes[a]
+        # Go up from the leaf, finding where the k'th occurrence is in
+        # each node's bit vector
+        for d in reversed(range(length)):
+            bit = code >> (length - d - 1) & 1
+            k = self.nodes[code >> (length - d), d].select(bit, k) + 1
+        return k - 1
+
+    def nbits(self) -> int:
+        """The number of bits used by the bit vectors."""
+        return sum(vector.nbits() for vector in self.nodes.values())